@@ -0,0 +1,296 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+TIME THE PHASES OF A DEPLOY ON SYNTHETIC REPOSITORIES
+
+    PYTHONPATH=.:vendor python benchmarks/deploy_harness.py --repos 20 --topology layered --history 5
+
+PHASES
+* generate - MAKE THE REPOSITORIES, REMOTES, file:// INDEX, AND twine/svn STAND-INS
+* graph (cold) - ModuleGraph WITH AN EMPTY STATE DIRECTORY
+* graph (warm) - ModuleGraph AGAIN, WITH THE PROBES REMEMBERED FROM THE COLD RUN
+* changes - CHANGE DETECTION ON EVERY REPOSITORY, NOTHING REMEMBERED
+* tests - THE TEST RUNNER OVER EACH MODULE TO DEPLOY, WITH THIS python (NO virtualenv)
+* publish - twine STAND-IN, THEN WAIT FOR THE INDEX TO SHOW EACH NEW VERSION
+* resume - Module.deploy() OF ONE MODULE FAILS DURING publish; THE SECOND deploy MUST NOT BUILD OR TEST AGAIN
+* plan - PREDICTED WALL TIME OF A DEPLOY, FROM THE STEP HISTORY IN THE STATE DIRECTORY
+
+WITH --end-to-end, THE tests AND publish PHASES ARE REPLACED BY A REAL Scheduler.run(), WHICH NEEDS
+virtualenv, build AND THE NETWORK (FOR pip)
+
+THE REPORT IS WRITTEN AS JSON (--report), AND APPENDED TO --history, SO RUNS CAN BE COMPARED ACROSS VERSIONS
+
+WITH --trace, EVERY COMMAND, INDEX REQUEST AND WAIT IS ALSO RECORDED AS A TRACE-EVENT FILE, AND ADDED
+TO THE STEP HISTORY, SO A SECOND --end-to-end RUN ON THE SAME --directory CAN COMPARE plan TO ACTUAL
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from time import time as unix_now
+
+from synthetic_repos import TOPOLOGIES, generate
+
+from mo_deploy import git_reader, module as module_module
+from mo_deploy.module import Module
+from mo_deploy.module_graph import ModuleGraph
+from mo_deploy.plan import Plan, StepHistory, wall_time
+from mo_deploy.scheduler import Scheduler
+from mo_deploy.state_store import StateStore, refs_signatures
+from mo_deploy.trace import tracer
+from mo_files import File
+from mo_threads import Thread, join_all_threads, stop_main_thread
+from pyLibrary.utils import Version
+
+PYTHON_VERSION = f"{sys.version_info.major}.{sys.version_info.minor}"
+
+
+class Phases(object):
+    def __init__(self):
+        self.phases = []
+
+    def __call__(self, name):
+        return _Phase(self, name)
+
+
+class _Phase(object):
+    def __init__(self, phases, name):
+        self.phases = phases
+        self.name = name
+        self.detail = {}
+
+    def __enter__(self):
+        print(f"=== {self.name} ===", flush=True)
+        self.start = unix_now()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.phases.phases.append({
+            "phase": self.name,
+            "seconds": round(unix_now() - self.start, 3),
+            "ok": exc_type is None,
+            **self.detail,
+        })
+
+
+def configure(info, work):
+    Module.git = "git"
+    Module.svn = info["svn"]
+    Module.twine = info["twine"]
+    Module.index_url = info["index"]
+    Module.python = {PYTHON_VERSION: sys.executable, "latest": sys.executable}
+    Module.test_versions = [PYTHON_VERSION]
+    Module.state_directory = os.path.join(work, "state")
+    Module.state = StateStore(File(Module.state_directory) / "probes.jsonl")
+
+
+def run_tests(graph, phase):
+    total = [0]
+
+    def test(module, please_stop):
+        with tempfile.TemporaryDirectory() as temp:
+            report = module.run_test_runner(sys.executable, PYTHON_VERSION, File(temp))
+            total[0] += report.summary.total
+
+    join_all_threads(Thread.run("test " + m.name, test, m) for m in _todo(graph))
+    phase.detail["tests"] = total[0]
+
+
+def publish(graph):
+    def upload(module, please_stop):
+        version = graph.get_next_version(module.name)
+        dist = module.dist_directory
+        dist.delete()
+        package = module.package_name.replace("-", "_")
+        (dist / f"{package}-{version}-py3-none-any.whl").write("synthetic wheel")
+        (dist / f"{package}-{version}.tar.gz").write("synthetic sdist")
+        module.pypi()
+
+    join_all_threads(Thread.run("publish " + m.name, upload, m) for m in _todo(graph))
+
+
+def resume(graph, phase):
+    """
+    build AND run_tests ARE REPLACED WITH STAND-INS THAT COUNT CALLS (THE REAL ONES NEED virtualenv AND build),
+    AND EVERY QUESTION IS ANSWERED "n"
+    """
+    module = _todo(graph)[0]
+    version = graph.get_next_version(module.name)
+    calls = {"build": 0, "tests": 0}
+
+    def build():
+        calls["build"] += 1
+        dist = module.dist_directory
+        dist.delete()
+        package = module.package_name.replace("-", "_")
+        (dist / f"{package}-{version}-py3-none-any.whl").write("synthetic wheel")
+        (dist / f"{package}-{version}.tar.gz").write("synthetic sdist")
+
+    def run_tests(python_version, please_stop, test_modules=None):
+        calls["tests"] += 1
+        # A NEW LOCKFILE, SO dev MOVES AFTER THE version PHASE, LIKE A REAL TEST RUN
+        (module.directory / "tests" / "requirements.lock").write(
+            f"# Tests pass with these versions {datetime.now().isoformat()}\n"
+        )
+
+    failed = []
+
+    def fail_once():
+        if not failed:
+            failed.append(True)
+            raise Exception("upload interrupted")
+
+    module.build = build
+    module.run_tests = run_tests
+    ask, module_module.ask = module_module.ask, lambda question: "n"
+    try:
+        try:
+            module.deploy(before_upload=fail_once)
+            raise Exception("expecting the first deploy to fail")
+        except Exception as cause:
+            if not failed:
+                raise cause
+        module.deploy(before_upload=fail_once)
+    finally:
+        module_module.ask = ask
+
+    phase.detail.update(module=module.name, **calls)
+    if calls != {"build": 1, "tests": 1}:
+        raise Exception(f"expecting one build and one test run, not {calls}")
+    if (File(module.state_directory) / "journal" / f"{module.name}.json").exists:
+        raise Exception("expecting the journal to be cleared")
+
+
+def _todo(graph):
+    return [m for m in graph.todo if isinstance(m, Module)]
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark mo-deploy on synthetic repositories")
+    parser.add_argument("--repos", type=int, default=20)
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="layered")
+    parser.add_argument("--history", type=int, default=5, help="releases per repository")
+    parser.add_argument("--deps", type=int, default=3, help="requirements per repository")
+    parser.add_argument("--changed", type=float, default=0.5, help="fraction of repositories with unreleased changes")
+    parser.add_argument("--stale", type=float, default=0.0, help="fraction of latest pins that are old versions")
+    parser.add_argument("--tests", type=int, default=3, help="test modules per repository")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--directory", help="work directory (default is a new temp directory)")
+    parser.add_argument("--concurrency", type=int, default=None, help="Scheduler max_workers for --end-to-end")
+    parser.add_argument("--end-to-end", action="store_true", help="run a real deploy instead of tests and publish")
+    parser.add_argument("--report", help="json file for this run (default <directory>/report.json)")
+    parser.add_argument("--history-file", help="jsonl file to append this run's report to")
+    parser.add_argument("--trace", help="trace-event json file for the phases after generate")
+    args = parser.parse_args()
+
+    work = os.path.abspath(args.directory or tempfile.mkdtemp(prefix="mo-deploy-bench-"))
+    phase = Phases()
+    report = {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "revision": revision(),
+        "python": PYTHON_VERSION,
+        "params": {k: v for k, v in vars(args).items() if k not in ["report", "history_file", "directory", "trace"]},
+        "phases": phase.phases,
+    }
+    try:
+        with phase("generate") as p:
+            info = generate(
+                work,
+                args.repos,
+                topology=args.topology,
+                history=args.history,
+                deps=args.deps,
+                changed=args.changed,
+                stale=args.stale,
+                tests=args.tests,
+                seed=args.seed,
+            )
+            p.detail["repos"] = len(info["repos"])
+        configure(info, work)
+        tracer.start(args.trace)
+
+        with phase("graph (cold)") as p:
+            graph = ModuleGraph(info["repos"], info["deploy"], Version(PYTHON_VERSION))
+            p.detail["todo"] = len(_todo(graph))
+
+        git_reader.close_all()
+        refs_signatures.clear()
+        Module.state = StateStore(File(Module.state_directory) / "probes.jsonl")
+        with phase("graph (warm)"):
+            graph = ModuleGraph(info["repos"], info["deploy"], Version(PYTHON_VERSION))
+
+        with phase("changes") as p:
+            modules = [Module(d, graph) for d in info["repos"]]
+            changed = []
+
+            def probe(module, please_stop):
+                module.state = None  # NOTHING REMEMBERED
+                if module.has_changes():
+                    changed.append(module.name)
+
+            join_all_threads(Thread.run("changes " + m.name, probe, m) for m in modules)
+            p.detail["changed"] = len(changed)
+
+        with phase("plan") as p:
+            history = StepHistory(File(Module.state_directory) / "durations.json")
+            plan = Plan(graph, history)
+            print(plan.report(args.concurrency))
+            p.detail["predicted"] = round(wall_time(plan.schedule(args.concurrency)), 3)
+            p.detail["priorities"] = {name: round(v) for name, v in plan.priorities().items()}
+
+        if args.end_to_end:
+            with phase("end-to-end"):
+                Scheduler(graph, max_workers=args.concurrency, priorities=plan.priorities()).run()
+        else:
+            with phase("tests") as p:
+                run_tests(graph, p)
+            with phase("publish"):
+                publish(graph)
+            with phase("resume") as p:
+                resume(graph, p)
+    finally:
+        trace = tracer.stop()
+        if trace is not None:
+            StepHistory(File(Module.state_directory) / "durations.json").record_trace(trace)
+        report_file = args.report or os.path.join(work, "report.json")
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        if args.history_file:
+            with open(args.history_file, "a") as f:
+                f.write(json.dumps(report) + "\n")
+
+        print()
+        print(f"{'phase':<16} {'seconds':>9}  detail")
+        for p in phase.phases:
+            detail = {k: v for k, v in p.items() if k not in ["phase", "seconds"]}
+            print(f"{p['phase']:<16} {p['seconds']:>9.3f}  {detail}")
+        print(f"report: {report_file}")
+
+        git_reader.close_all()
+        stop_main_thread()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+COMPARE A git push AFTER EVERY UPDATE WITH THE COALESCED PushQueue, ON LOCAL BARE REMOTES
+
+    PYTHONPATH=.:vendor python benchmarks/push_queue.py --repos 20 --updates 3
+
+EACH REPOSITORY GETS --updates COMMITS ON dev, A RELEASE COMMIT AND TAG ON master, LIKE A DEPLOY.
+AFTERWARD, THE REFS OF EACH BARE REMOTE ARE COMPARED TO THE LOCAL REFS
+"""
+import argparse
+import os
+import subprocess
+import tempfile
+from time import time as unix_now
+
+from synthetic_repos import generate
+
+from mo_deploy.module import Module
+from mo_deploy.push_queue import PushQueue
+from mo_threads import Thread, join_all_threads, stop_main_thread
+
+
+def update(module, updates, push):
+    """
+    COMMIT TO dev updates TIMES, THEN RELEASE TO master, CALLING push(module, ref, tag) AFTER EACH
+    """
+    for u in range(updates):
+        with open(os.path.join(module.directory.os_path, "CHANGES.txt"), "a") as f:
+            f.write(f"update {u}\n")
+        module.local([module.git, "commit", "-q", "-am", f"update {u}"])
+        push(module, module.dev_branch, False)
+    version = f"1.99.{os.getpid() % 1000}{updates}"
+    module.local([module.git, "checkout", "-q", module.master_branch])
+    module.local([module.git, "merge", "-q", "--no-ff", "-m", "release " + version, module.dev_branch])
+    module.local([module.git, "tag", "-f", version])
+    push(module, version, True)
+    push(module, module.master_branch, False)
+    module.local([module.git, "checkout", "-q", module.dev_branch])
+
+
+def serial_push(module, ref, tag):
+    module.local([module.git, "push", "-f", "origin", ref])
+
+
+def refs(directory, remote):
+    local = subprocess.run(
+        ["git", "for-each-ref", "--format=%(objectname) %(refname)", "refs/heads", "refs/tags"],
+        cwd=directory,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split("\n")
+    remote = subprocess.run(
+        ["git", "for-each-ref", "--format=%(objectname) %(refname)", "refs/heads", "refs/tags"],
+        cwd=remote,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split("\n")
+    return sorted(l for l in local if l), sorted(r for r in remote if r)
+
+
+def run(info, updates, coalesce):
+    modules = [Module(d, None) for d in info["repos"]]
+    for d in info["repos"]:
+        with open(os.path.join(d, "CHANGES.txt"), "w") as f:
+            f.write("")
+        subprocess.run(["git", "add", "CHANGES.txt"], cwd=d, check=True)
+        subprocess.run(["git", "commit", "-qm", "changes file"], cwd=d, check=True)
+
+    queue = PushQueue()
+    push = (lambda m, ref, tag: queue.push(m, ref, tag=tag, force=tag)) if coalesce else serial_push
+
+    start = unix_now()
+    join_all_threads(Thread.run("update " + m.name, lambda m, please_stop: update(m, updates, push), m) for m in modules)
+    updated = unix_now()
+    failed = queue.flush() if coalesce else {}
+    end = unix_now()
+
+    same = all(
+        local == remote
+        for d in info["repos"]
+        for local, remote in [refs(d, os.path.join(os.path.dirname(os.path.dirname(d)), "remotes", os.path.basename(d) + ".git"))]
+    )
+    return updated - start, end - updated, failed, same
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark coalesced git pushes")
+    parser.add_argument("--repos", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=3, help="dev commits per repository")
+    args = parser.parse_args()
+    Module.git = "git"
+
+    try:
+        print(f"{'mode':<10} {'updates s':>10} {'flush s':>8} {'total s':>8} same")
+        for coalesce in [False, True]:
+            with tempfile.TemporaryDirectory(prefix="mo-deploy-push-") as work:
+                info = generate(work, args.repos, topology="chain", history=1, tests=0)
+                updates_time, flush_time, failed, same = run(info, args.updates, coalesce)
+                mode = "coalesced" if coalesce else "serial"
+                print(
+                    f"{mode:<10} {updates_time:>10.3f} {flush_time:>8.3f} {updates_time + flush_time:>8.3f} {same}"
+                    f"{' failed ' + str(sorted(failed)) if failed else ''}"
+                )
+    finally:
+        stop_main_thread()
+
+
+if __name__ == "__main__":
+    main()
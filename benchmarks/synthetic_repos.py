@@ -0,0 +1,230 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+GENERATE A FAMILY OF LOCAL GIT REPOSITORIES THAT LOOK LIKE THE mo-* PROJECTS
+
+EACH REPOSITORY HAS
+* packaging/setuptools.json, packaging/requirements.txt AND README.md
+* A TAGGED RELEASE ON master FOR EACH VERSION IN ITS HISTORY, PINNING ITS REQUIREMENTS
+* A dev BRANCH, WITH A CODE CHANGE IF THE REPOSITORY IS CHOSEN TO CHANGE
+* vendor/<requirement>/ DIRECTORIES THAT LOOK LIKE svn WORKING COPIES
+* tests/ WITH requirements.txt, smoke_test.py AND SOME TEST MODULES
+* A BARE origin REMOTE
+
+ALSO A file:// PACKAGE INDEX WITH THE TAGGED RELEASES, AND STAND-INS FOR twine AND svn
+"""
+import json
+import os
+import random
+import stat
+import subprocess
+import sys
+
+TOPOLOGIES = ["chain", "tree", "layered", "random"]
+MAJOR = 1
+
+TWINE = '''
+import glob, json, os, sys
+
+# STAND-IN FOR twine: "UPLOAD" BY ADDING THE RELEASE TO THE file:// INDEX
+INDEX = {index!r}
+files = [f for pattern in sys.argv[1:] if not pattern.startswith("-") and pattern != "upload" for f in glob.glob(pattern)]
+if not files:
+    print("no files to upload")
+    sys.exit(1)
+for f in files:
+    name, version = os.path.basename(f).split("-")[:2]
+    if version.endswith(".tar.gz"):
+        version = version[: -len(".tar.gz")]
+    name = name.replace("_", "-")
+    filename = os.path.join(INDEX, name, "json")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    try:
+        with open(filename) as stream:
+            content = json.load(stream)
+    except Exception:
+        content = {{"releases": {{}}}}
+    content["releases"].setdefault(version, []).append(os.path.basename(f))
+    with open(filename + ".tmp", "w") as stream:
+        json.dump(content, stream)
+    os.replace(filename + ".tmp", filename)
+    print("Uploading " + os.path.basename(f))
+'''
+
+SVN = '''
+import sys
+
+# STAND-IN FOR svn: EVERY WORKING COPY IS ALREADY UP TO DATE, AND HAS NO LOCAL CHANGES
+if sys.argv[1:2] != ["status"]:
+    print("At revision 1.")
+'''
+
+
+def generate(directory, num_repos, topology="layered", history=5, deps=3, changed=0.5, stale=0.0, tests=3, seed=42):
+    """
+    :param directory: EMPTY DIRECTORY TO FILL
+    :param num_repos: NUMBER OF REPOSITORIES
+    :param topology: ONE OF TOPOLOGIES
+    :param history: RELEASES PER REPOSITORY
+    :param deps: REQUIREMENTS PER REPOSITORY (FOR layered AND random)
+    :param changed: FRACTION OF REPOSITORIES WITH UNRELEASED CHANGES ON dev
+    :param stale: FRACTION OF REQUIREMENTS IN THE LATEST RELEASE THAT PIN AN OLD VERSION
+    :param tests: TEST MODULES PER REPOSITORY
+    :return: DICT WITH repos (LIST OF DIRECTORIES), names, index (file:// URL), twine, svn, deploy (NAMES WITH NO DEPENDENTS)
+    """
+    rand = random.Random(seed)
+    directory = os.path.abspath(directory)
+    repos_dir = os.path.join(directory, "repos")
+    remotes_dir = os.path.join(directory, "remotes")
+    index_dir = os.path.join(directory, "index")
+    bin_dir = os.path.join(directory, "bin")
+    for d in [repos_dir, remotes_dir, index_dir, bin_dir]:
+        os.makedirs(d, exist_ok=True)
+
+    names = [f"pkg-{i:03d}" for i in range(num_repos)]
+    requires = {name: [names[j] for j in _requirements(topology, i, deps, rand)] for i, name in enumerate(names)}
+    required = set(r for reqs in requires.values() for r in reqs)
+
+    for i, name in enumerate(names):
+        _make_repo(
+            repos_dir, remotes_dir, index_dir, name, requires[name], history, rand.random() < changed, stale, tests, rand
+        )
+
+    return {
+        "repos": [os.path.join(repos_dir, name) for name in names],
+        "names": names,
+        "requires": requires,
+        "index": "file://" + index_dir.replace(os.sep, "/"),
+        "twine": _script(bin_dir, "twine", TWINE.format(index=index_dir)),
+        "svn": _script(bin_dir, "svn", SVN),
+        "deploy": [name for name in names if name not in required],
+    }
+
+
+def _requirements(topology, i, deps, rand):
+    if not i:
+        return []
+    if topology == "chain":
+        return [i - 1]
+    if topology == "tree":
+        return [(i - 1) // 2]
+    if topology == "layered":
+        width = max(1, deps * 2)
+        layer = i // width
+        if not layer:
+            return []
+        previous = range((layer - 1) * width, layer * width)
+        return sorted(rand.sample(previous, min(deps, len(previous))))
+    if topology == "random":
+        return sorted(rand.sample(range(i), min(i, rand.randint(0, deps))))
+    raise Exception(f"unknown topology {topology}")
+
+
+def _make_repo(repos_dir, remotes_dir, index_dir, name, requires, history, is_changed, stale, num_tests, rand):
+    package = name.replace("-", "_")
+    repo = os.path.join(repos_dir, name)
+    remote = os.path.join(remotes_dir, name + ".git")
+    _git(remotes_dir, "init", "--bare", "-q", remote)
+    _git(repos_dir, "init", "-q", "-b", "master", repo)
+    _git(repo, "config", "user.name", "benchmark")
+    _git(repo, "config", "user.email", "benchmark@localhost")
+    _git(repo, "remote", "add", "origin", remote)
+
+    _write(repo, "README.md", f"# {name}\n\nSynthetic package for benchmarks\n")
+    _write(repo, ".gitignore", "__pycache__\n*.pyc\n.svn\n")
+    _write(repo, f"{package}/__init__.py", f"VERSION = None\n\n\ndef value():\n    return {name!r}\n")
+    _write(repo, f"{package}/core.py", f"from {package} import value\n\n\ndef double():\n    return value() * 2\n")
+    _write(repo, "tests/__init__.py", "")
+    _write(repo, "tests/requirements.txt", "")
+    _write(repo, "tests/smoke_test.py", f"import {package}\n\nprint({package}.value())\n")
+    for t in range(num_tests):
+        _write(
+            repo,
+            f"tests/test_{package}_{t}.py",
+            "import unittest\n\n"
+            f"from {package}.core import double\n\n\n"
+            f"class Test{t}(unittest.TestCase):\n"
+            "    def test_double(self):\n"
+            f"        self.assertEqual(double(), {name * 2!r})\n",
+        )
+    for r in requires:
+        # LOOKS LIKE AN svn WORKING COPY OF THE VENDORED REQUIREMENT
+        _write(repo, f"vendor/{r.replace('-', '_')}/__init__.py", f"# vendored {r}\n")
+        os.makedirs(os.path.join(repo, "vendor", r.replace("-", "_"), ".svn"), exist_ok=True)
+        _write(repo, f"vendor/{r.replace('-', '_')}/.svn/entries", "12\n")
+
+    releases = {}
+    for h in range(1, history + 1):
+        version = f"{MAJOR}.{h}.0"
+        pins = []
+        for r in requires:
+            pinned = h
+            if h == history and rand.random() < stale:
+                pinned = rand.randint(1, history - 1) if history > 1 else h
+            pins.append(f"{r}=={MAJOR}.{pinned}.0")
+        _write(repo, "packaging/requirements.txt", "\n".join(requires) + "\n")
+        _write(repo, "packaging/setuptools.json", json.dumps(_setup(name, package, version, pins), indent=4))
+        _write(repo, f"{package}/__init__.py", f"VERSION = {version!r}\n\n\ndef value():\n    return {name!r}\n")
+        _git(repo, "add", "-A")
+        _git(repo, "commit", "-q", "-m", f"release {version}")
+        _git(repo, "tag", version)
+        releases[version] = []
+
+    _git(repo, "checkout", "-q", "-b", "dev")
+    if is_changed:
+        _write(repo, f"{package}/core.py", f"from {package} import value\n\n\ndef double():\n    return value() + value()\n")
+        _git(repo, "commit", "-q", "-am", "unreleased change")
+    _git(repo, "push", "-q", "origin", "master", "dev", "--tags")
+
+    os.makedirs(os.path.join(index_dir, name), exist_ok=True)
+    _write(index_dir, f"{name}/json", json.dumps({"releases": releases}))
+
+
+def _setup(name, package, version, install_requires):
+    python = f"{sys.version_info.major}.{sys.version_info.minor}"
+    return {
+        "name": name,
+        "version": version,
+        "description": f"Synthetic package {name}",
+        "license": "MPL 2.0",
+        "packages": [package],
+        "install_requires": install_requires,
+        "classifiers": [f"Programming Language :: Python :: {python}"],
+        "python_requires": ">=3.7",
+    }
+
+
+def _script(bin_dir, name, source):
+    """
+    :return: EXECUTABLE THAT RUNS source WITH THIS PYTHON
+    """
+    filename = os.path.join(bin_dir, name + ".py")
+    with open(filename, "w") as f:
+        f.write(source)
+    if os.name == "nt":
+        wrapper = os.path.join(bin_dir, name + ".bat")
+        with open(wrapper, "w") as f:
+            f.write(f'@"{sys.executable}" "{filename}" %*\n')
+    else:
+        wrapper = os.path.join(bin_dir, name)
+        with open(wrapper, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{filename}" "$@"\n')
+        os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return wrapper
+
+
+def _write(root, path, content):
+    filename = os.path.join(root, path)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w", newline="\n") as f:
+        f.write(content)
+
+
+def _git(cwd, *args):
+    subprocess.run(["git", *args], cwd=cwd, check=True, stdout=subprocess.DEVNULL)
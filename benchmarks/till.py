@@ -0,0 +1,163 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+BENCHMARK THE Till TIMER DAEMON WITH MANY PENDING TIMERS
+
+    PYTHONPATH=.:vendor python benchmarks/till.py --pending 100000
+
+1. ONE TICK OF THE DAEMON, WITH --pending TIMERS WAITING AND --new ARRIVING: THE OLD
+   SORT-EVERY-TICK LIST (COPIED BELOW) AGAINST TimerHeap
+2. THE SAME, AFTER 3/4 OF THE PENDING Till ARE GARBAGE COLLECTED
+3. THE REAL DAEMON: TIME TO MAKE --pending Till, AND HOW LATE A SHORT Till FIRES WHILE THEY WAIT,
+   COMPARED TO NONE WAITING (THE DAEMON WAKES EVERY till.INTERVAL, SO SOME LATENESS IS EXPECTED)
+"""
+import argparse
+import gc
+import random
+from collections import namedtuple
+from time import time as unix_now, sleep
+from weakref import ref
+
+from mo_threads import Till, stop_main_thread
+from mo_threads.till import TimerHeap, TodoItem
+
+OldTodoItem = namedtuple("OldTodoItem", ["timestamp", "ref"])
+
+
+class Target(object):
+    # STANDS IN FOR A Till
+    __slots__ = ["__weakref__"]
+
+
+class Owner(object):
+    # STANDS IN FOR Till.collected, SO THE REAL DAEMON IS NOT INVOLVED
+    collected = []
+
+
+def collected(_):
+    Owner.collected.append(1)
+
+
+def old_actual_time(todo):
+    return 0 if todo.ref() is None else todo.timestamp
+
+
+def old_tick(sorted_timers, new_timers, now):
+    """
+    THE BODY OF THE PREVIOUS daemon LOOP
+    :return: (work, sorted_timers)
+    """
+    sorted_timers.extend(new_timers)
+    sorted_timers.sort(key=old_actual_time)
+    for i, rec in enumerate(sorted_timers):
+        if now < old_actual_time(rec):
+            return sorted_timers[:i], sorted_timers[i:]
+    return sorted_timers, []
+
+
+def make(targets, now, rand, old):
+    sequence = iter(range(10 ** 9))
+    if old:
+        return [OldTodoItem(now + rand.uniform(1, 3600), ref(t)) for t in targets]
+    return [TodoItem(now + rand.uniform(1, 3600), next(sequence), ref(t, collected)) for t in targets]
+
+
+def ticks(pending, new, num_ticks, seed, garbage):
+    """
+    :return: FOR OLD, THEN NEW: (SECONDS PER TICK, SECONDS TO LOAD pending, TIMERS LEFT, TIMERS FIRED)
+    """
+    now = 1_000_000.0
+    result = []
+    for old in [True, False]:
+        rand = random.Random(seed)
+        targets = [Target() for _ in range(pending)]
+        loaded = make(targets, now, rand, old)
+        start = unix_now()
+        if old:
+            _, timers = old_tick([], loaded, now)
+        else:
+            timers = TimerHeap(Owner)
+            timers.add(loaded)
+            timers.pop_due(now)
+        load = unix_now() - start
+        if garbage:
+            del targets[: pending * 3 // 4]
+            gc.collect()
+
+        arriving = [Target() for _ in range(new * num_ticks)]
+        batches = make(arriving, now, rand, old)
+        fired = 0
+        start = unix_now()
+        for i in range(num_ticks):
+            now += 0.1
+            batch = batches[i * new : (i + 1) * new]
+            if old:
+                work, timers = old_tick(timers, batch, now)
+            else:
+                timers.add(batch)
+                work = timers.pop_due(now)
+            fired += len(work)
+        result.append(((unix_now() - start) / num_ticks, load, len(timers), fired))
+    return result
+
+
+def latency(pending, samples):
+    """
+    :return: (SECONDS TO MAKE pending Till, MEAN AND MAX SECONDS LATE OF A 10ms Till)
+    """
+    start = unix_now()
+    waiting = [Till(seconds=60 + i % 3600) for i in range(pending)]
+    made = unix_now() - start
+    sleep(0.5)  # LET THE DAEMON TAKE THEM
+    late = []
+    for _ in range(samples):
+        start = unix_now()
+        Till(seconds=0.01).wait()
+        late.append(unix_now() - start - 0.01)
+    del waiting
+    gc.collect()
+    return made, sum(late) / len(late), max(late)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the Till timer daemon")
+    parser.add_argument("--pending", type=int, default=100_000, help="timers waiting")
+    parser.add_argument("--new", type=int, default=100, help="timers added per tick")
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=20, help="short timers to measure latency")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    try:
+        print(f"{args.pending} pending, {args.new} new per tick")
+        print(
+            f"{'case':<20} {'old ms/tick':>12} {'new ms/tick':>12} {'speedup':>8} {'old load s':>11} {'new load s':>11}"
+            " left (old/new)"
+        )
+        for name, garbage in [("live", False), ("3/4 collected", True)]:
+            (old_tick_s, old_load, old_left, old_fired), (new_tick_s, new_load, new_left, new_fired) = ticks(
+                args.pending, args.new, args.ticks, args.seed, garbage
+            )
+            print(
+                f"{name:<20} {old_tick_s * 1000:>12.2f} {new_tick_s * 1000:>12.3f} {old_tick_s / new_tick_s:>8.0f}"
+                f" {old_load:>11.3f} {new_load:>11.3f} {old_left}/{new_left}"
+            )
+
+        for pending in [0, args.pending]:
+            made, mean_late, max_late = latency(pending, args.samples)
+            print(
+                f"daemon: made {pending} Till in {made:.3f}s; a 10ms Till fires {mean_late * 1000:.1f}ms late"
+                f" (max {max_late * 1000:.1f}ms)"
+            )
+    finally:
+        stop_main_thread()
+
+
+if __name__ == "__main__":
+    main()
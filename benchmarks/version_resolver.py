@@ -0,0 +1,203 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+BENCHMARK VersionResolver ON SYNTHETIC DEPENDENCY GRAPHS
+
+    PYTHONPATH=.:vendor python benchmarks/version_resolver.py --modules 100 200 400 --history 30
+
+THE OLD restart-on-"not done" SCAN IS RUN AS A BASELINE ON THE SMALLER GRAPHS (--legacy-limit), AND
+BOTH RESULTS ARE COMPARED
+"""
+import argparse
+import random
+from time import time as unix_now
+
+import mo_math
+from mo_deploy.version_resolver import VersionResolver
+from mo_logs import logger
+from mo_logs.exceptions import Except
+from pyLibrary.utils import Version
+
+TODAY = 24001
+NEXT_MINOR = 99
+
+
+class FakeModule(object):
+    """
+    ENOUGH OF Module FOR THE RESOLVER: A NAME, A CURRENT VERSION, AND REQUIREMENTS FOR EACH OLD VERSION
+    """
+
+    def __init__(self, name, history):
+        self.name = name
+        self.history = history  # MAP FROM Version TO LIST OF {"name", "version"}
+        self.version = max(history.keys())
+        self.calls = 0
+
+    def get_version(self):
+        return self.version, ""
+
+    def get_old_dependencies(self, version):
+        self.calls += 1
+        deps = self.history.get(version)
+        if deps is None:
+            # NOT RELEASED YET, SO USE THE CURRENT REQUIREMENTS
+            deps = self.history[self.version]
+        return deps
+
+
+def make_graph(num_modules, history, max_deps, num_roots, conflict_rate, seed):
+    """
+    MODULE i ONLY REQUIRES MODULES j<i, SO THE GRAPH IS A DAG. EACH OLD VERSION
+    PINS ITS REQUIREMENTS TO SOME VERSION OF THEM; MOSTLY THE CURRENT ONE, SOMETIMES AN OLDER ONE
+    """
+    rand = random.Random(seed)
+    modules = {}
+    for i in range(num_modules):
+        name = f"m{i:04d}"
+        versions = [Version((1, minor, 0)) for minor in range(1, history + 1)]
+        deps_by_version = {}
+        for v in versions:
+            deps = []
+            if i:
+                for j in sorted(rand.sample(range(i), min(i, rand.randint(0, max_deps)))):
+                    req = modules[f"m{j:04d}"]
+                    if rand.random() < conflict_rate:
+                        req_version = rand.choice(list(req.history.keys()))
+                    else:
+                        req_version = req.version
+                    deps.append({"name": req.name, "version": req_version})
+            if rand.random() < 0.5:
+                deps.append({"name": "third-party", "version": None})
+            deps_by_version[v] = deps
+        modules[name] = FakeModule(name, deps_by_version)
+    roots = [modules[n] for n in rand.sample(sorted(modules.keys()), num_roots)]
+    return modules, roots
+
+
+def initial_state(modules, roots):
+    curr_versions = {name: m.version for name, m in modules.items()}
+    next_version = {r.name: Version((r.version.major, NEXT_MINOR, TODAY)) for r in roots}
+    return curr_versions, next_version, set(next_version.keys())
+
+
+def run_resolver(modules, roots):
+    curr_versions, next_version, is_upgrading = initial_state(modules, roots)
+    VersionResolver(modules, curr_versions, NEXT_MINOR, TODAY, lambda name: Version("3.0.0")).resolve(
+        roots, next_version, is_upgrading
+    )
+    return next_version, is_upgrading
+
+
+def run_legacy(modules, roots, max_visits):
+    """
+    THE SCAN THAT VersionResolver REPLACED: DEPTH-FIRST, NO MEMO, RESTART ON EVERY CHANGE
+    """
+    curr_versions, next_version, is_upgrading = initial_state(modules, roots)
+    visits = [0]
+
+    def scan(module, version, new_version, ancestor_upgrading, depth=0):
+        visits[0] += 1
+        if visits[0] > max_visits:
+            raise Exception("too many visits")
+        reqs = module.get_old_dependencies(version)
+        any_decendant_upgrading = False
+        for req in reqs:
+            req_name, req_version = req["name"], req["version"]
+            managed_req = modules.get(req_name)
+            if not req_version:
+                curr_version = curr_versions.setdefault(req_name, Version("3.0.0"))
+                req_version = curr_version
+            else:
+                curr_version = curr_versions.setdefault(req_name, req_version)
+            req_new_version = Version((
+                mo_math.max(curr_version.major, managed_req.get_version()[0].major if managed_req else None),
+                NEXT_MINOR,
+                TODAY,
+            ))
+            if module.name not in is_upgrading:
+                if curr_version < req_version:
+                    is_upgrading.add(module.name)
+                    next_version[req_name] = req_new_version
+                    logger.error("not done")
+                elif req_version < curr_version:
+                    is_upgrading.add(module.name)
+                    next_version[module.name] = Version((module.version.major, NEXT_MINOR, TODAY))
+                    logger.error("not done")
+            if managed_req:
+                descendant_upgrading = scan(
+                    managed_req,
+                    curr_version,
+                    req_new_version,
+                    ancestor_upgrading or module.name in is_upgrading,
+                    depth=depth + 1,
+                )
+                any_decendant_upgrading |= descendant_upgrading
+                if module.name not in is_upgrading and descendant_upgrading and ancestor_upgrading:
+                    is_upgrading.add(module.name)
+                    next_version[module.name] = new_version
+                    logger.error("not done")
+        return any_decendant_upgrading or module.name in is_upgrading
+
+    restarts = 0
+    while True:
+        try:
+            for t in roots:
+                scan(t, next_version[t.name], None, True)
+        except Exception as cause:
+            cause = Except.wrap(cause)
+            if "not done" in cause:
+                restarts += 1
+                continue
+            if "too many visits" in cause:
+                return None, None, visits[0], restarts
+            raise
+        else:
+            break
+    return next_version, is_upgrading, visits[0], restarts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the version resolver")
+    parser.add_argument("--modules", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--history", type=int, default=30, help="versions per module")
+    parser.add_argument("--deps", type=int, default=6, help="maximum requirements per version")
+    parser.add_argument("--roots", type=int, default=5, help="modules to deploy")
+    parser.add_argument("--conflicts", type=float, default=0.05, help="chance a requirement pins an old version")
+    parser.add_argument("--legacy-limit", type=int, default=100, help="largest graph to run the old scan on")
+    parser.add_argument("--max-visits", type=int, default=2_000_000, help="give up on the old scan after this")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'modules':>8} {'resolver s':>11} {'expanded':>9} {'upgrading':>10} {'legacy s':>9} {'visits':>10} {'restarts':>9} same")
+    for n in args.modules:
+        modules, roots = make_graph(n, args.history, args.deps, min(args.roots, n), args.conflicts, args.seed)
+
+        start = unix_now()
+        next_version, is_upgrading = run_resolver(modules, roots)
+        resolver_time = unix_now() - start
+        expanded = sum(m.calls for m in modules.values())
+
+        legacy = "-", "-", "-", "-"
+        if n <= args.legacy_limit:
+            start = unix_now()
+            old_next, old_upgrading, visits, restarts = run_legacy(modules, roots, args.max_visits)
+            legacy_time = unix_now() - start
+            if old_upgrading is None:
+                legacy = f">{legacy_time:.2f}", f">{visits}", restarts, "gave up"
+            else:
+                same = old_upgrading == is_upgrading and old_next == next_version
+                legacy = f"{legacy_time:.2f}", visits, restarts, same
+        print(
+            f"{n:>8} {resolver_time:>11.3f} {expanded:>9} {len(is_upgrading):>10} {legacy[0]:>9} {legacy[1]:>10}"
+            f" {legacy[2]:>9} {legacy[3]}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+BENCHMARK THE TREE WALKS OF A DEPLOY ON A LARGE VENDORED REPOSITORY
+
+    PYTHONPATH=.:vendor python benchmarks/walk.py --vendored 200 --files 20
+
+THE REPOSITORY HAS A .git WITH MANY LOOSE OBJECTS, AND vendor/<package>/ DIRECTORIES THAT ARE svn
+WORKING COPIES WITH THEIR OWN .svn. EACH WALK IS TIMED THE OLD WAY (File.leaves, File.find) AND
+WITH File.walk()
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+from time import time as unix_now
+
+from mo_deploy.module import NOT_PACKAGES, VCS_DIRECTORIES
+from mo_deploy.svn_sync import find_working_copies
+from mo_files import File
+
+
+def make_tree(directory, vendored, files, depth, objects, seed):
+    rand = random.Random(seed)
+
+    def write(path, content=""):
+        filename = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write(content)
+
+    def package(prefix, levels):
+        write(f"{prefix}/__init__.py")
+        for i in range(files):
+            write(f"{prefix}/module_{i}.py", "VALUE = 1\n")
+            if rand.random() < 0.3:
+                write(f"{prefix}/__pycache__/module_{i}.cpython-311.pyc")
+        if levels:
+            for i in range(2):
+                package(f"{prefix}/sub_{i}", levels - 1)
+
+    for i in range(objects):
+        name = f"{rand.getrandbits(160):040x}"
+        write(f".git/objects/{name[:2]}/{name[2:]}")
+    package("my_package", depth)
+    package("tests", 1)
+    for v in range(vendored):
+        package(f"vendor/vendored_{v}", depth)
+        for i in range(files):
+            write(f"vendor/vendored_{v}/.svn/pristine/{i:02x}/{rand.getrandbits(160):040x}.svn-base")
+        write(f"vendor/vendored_{v}/.svn/wc.db")
+
+
+def old_packages(directory):
+    return sorted(
+        dir_name.replace("/", ".")
+        for f in directory.leaves
+        if f.stem == "__init__" and f.extension == "py"
+        for dir_name in [f.parent.abs_path[len(directory.abs_path) + 1 :]]
+        if dir_name
+        and not dir_name.startswith("tests/")
+        and not dir_name.startswith(".")
+        and not dir_name.startswith("vendor/")
+        and dir_name != "tests"
+    )
+
+
+def new_packages(directory):
+    return sorted(
+        f.parent.replace("/", ".") for f in directory.walk(ignore=NOT_PACKAGES) if f.name == "__init__.py" and f.parent
+    )
+
+
+def old_pyc(directory):
+    return sorted(f.os_path for f in directory.leaves if f.extension == "pyc")
+
+
+def new_pyc(directory):
+    return sorted(f.os_path for f in directory.walk(ignore=VCS_DIRECTORIES) if f.extension == "pyc")
+
+
+def old_working_copies(directory):
+    return sorted(set(d.parent.os_path for d in directory.find(r"\.svn")))
+
+
+def new_working_copies(directory):
+    return find_working_copies(directory)
+
+
+def timed(func, *args):
+    start = unix_now()
+    result = func(*args)
+    return unix_now() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark walking a vendored repository")
+    parser.add_argument("--vendored", type=int, default=200, help="vendored packages")
+    parser.add_argument("--files", type=int, default=20, help="modules per package directory")
+    parser.add_argument("--depth", type=int, default=2, help="levels of subpackages")
+    parser.add_argument("--objects", type=int, default=20000, help="loose objects in .git")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="mo-deploy-walk-")
+    try:
+        make_tree(directory, args.vendored, args.files, args.depth, args.objects, args.seed)
+        repo = File(directory)
+        total = sum(len(files) + len(dirs) for _, dirs, files in os.walk(directory))
+        print(f"{total} entries in {directory}")
+        print(f"{'walk':<16} {'old s':>8} {'new s':>8} {'speedup':>8} {'found':>7} same")
+        for name, old, new in [
+            ("packages", old_packages, new_packages),
+            ("pyc", old_pyc, new_pyc),
+            ("working copies", old_working_copies, new_working_copies),
+        ]:
+            old_time, old_result = timed(old, repo)
+            new_time, new_result = timed(new, repo)
+            same = old_result == new_result
+            print(
+                f"{name:<16} {old_time:>8.3f} {new_time:>8.3f} {old_time / max(new_time, 1e-6):>8.1f} {len(new_result):>7}"
+                f" {same}"
+            )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
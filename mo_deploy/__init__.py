@@ -6,21 +6,47 @@
 #
 # Author: Kyle Lahnakoski (kyle@lahnakoski.com)
 #
+from mo_deploy import git_reader
 from mo_deploy.module import Module
 from mo_deploy.module_graph import ModuleGraph
+from mo_deploy.plan import Plan, StepHistory
+from mo_deploy.scheduler import Scheduler
+from mo_deploy.state_store import StateStore
+from mo_deploy.trace import tracer
 from mo_dots import listwrap, from_data
 from mo_files import File, URL
 from mo_logs import logger, constants, startup
 from mo_threads import Process, stop_main_thread, Command
+from mo_threads.commands import shell_stats
+from mo_threads.governor import governor
 from pyLibrary.utils import Version
 
 
 def main():
 
     try:
-        settings = startup.read_settings()
+        settings = startup.read_settings(defs=[
+            {
+                "name": ["--plan"],
+                "help": "show the predicted schedule, critical path and wall time, then exit without changing anything",
+                "action": "store_true",
+                "dest": "plan",
+            },
+            {
+                "name": ["--concurrency"],
+                "help": "number of modules to deploy at once (overrides settings)",
+                "type": int,
+                "dest": "concurrency",
+            },
+        ])
+        concurrency = settings.args.concurrency or settings.concurrency
         constants.set(settings.constants)
         logger.start(settings.debug)
+        # RECORD EVERY COMMAND, INDEX REQUEST AND WAIT; ONLY WRITTEN TO settings.trace IF GIVEN
+        tracer.start(settings.trace or None)
+        # CONCURRENT cpu-heavy, io-heavy AND network COMMANDS
+        for resource, limit in (settings.resources or {}).items():
+            governor.set_limit(resource, limit)
 
         # ENSURE python HAS latest
         python = settings.general.python
@@ -47,8 +73,11 @@ def main():
         # SET Module VARIABLES (IN general)
         for k, v in settings.general.items():
             setattr(Module, k, from_data(v))
+        # PROBES OF UNCHANGED REPOSITORIES ARE REMEMBERED BETWEEN RUNS
+        Module.state = StateStore(File(Module.state_directory) / "probes.jsonl")
 
-        graph = ModuleGraph(listwrap(settings.managed), settings.deploy, latest)
+        with tracer.phase("graph"):
+            graph = ModuleGraph(listwrap(settings.managed), settings.deploy, latest, dry_run=settings.args.plan)
 
         # python -m pip install --upgrade setuptools wheel
         # python -m pip install --user --upgrade twine
@@ -56,14 +85,23 @@ def main():
         if not graph.todo:
             logger.alert("No modules need to deploy")
             return
+        plan = Plan(graph, StepHistory(File(Module.state_directory) / "durations.json"))
+        logger.info("Plan\n{plan}", plan=plan.report(concurrency))
+        if settings.args.plan:
+            return
         input("Press <Enter> to continue ...")
-        for m in graph.todo:
-            logger.alert("DEPLOY {{module|upper}} - {{version}}", module=m.name, version=graph.get_next_version(m.name))
-            m.deploy()
+        Scheduler(graph, max_workers=concurrency, priorities=plan.priorities()).run()
 
     except Exception as e:
         logger.warning("Problem with deploy", cause=e)
     finally:
+        trace = tracer.stop()
+        if trace is not None:
+            # DURATIONS OF THIS RUN IMPROVE THE NEXT PLAN
+            StepHistory(File(Module.state_directory) / "durations.json").record_trace(trace)
+        git_reader.close_all()
+        logger.info("Shells {stats|json}", stats=shell_stats())
+        logger.info("Resources {stats|json}", stats=governor.stats())
         stop_main_thread()
 
 
@@ -0,0 +1,134 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from toposort import toposort
+
+from mo_dots import listwrap
+from mo_logs import logger
+
+
+class DependencyIndex(object):
+    """
+    TRANSITIVE REQUIREMENTS AND DEPENDENTS OF EVERY PACKAGE, BUILT ONCE FROM THE REQUIREMENT GRAPH
+
+    EACH PACKAGE HAS A POSITION IN TOPOLOGICAL ORDER (REQUIREMENTS FIRST), AND EACH SET OF
+    PACKAGES IS AN int WITH ONE BIT PER POSITION. A PACKAGE'S SETS INCLUDE THE PACKAGE ITSELF.
+
+    * requires(a, b) - DOES a NEED b? ONE LOOKUP AND ONE BIT TEST
+    * requirements(names) - EVERYTHING names NEED
+    * dependents(names) - EVERYTHING THAT NEEDS names, WHICH MUST BE RE-RELEASED IF names CHANGE
+    """
+
+    def __init__(self, graph):
+        """
+        :param graph: MAP FROM PACKAGE NAME TO SET OF PACKAGE NAMES IT DIRECTLY REQUIRES
+        """
+        self.order = [name for batch in toposort({k: set(v) for k, v in graph.items()}) for name in sorted(batch)]
+        self.position = {name: i for i, name in enumerate(self.order)}
+        size = len(self.order)
+
+        direct = [0] * size
+        for name, reqs in graph.items():
+            i = self.position[name]
+            for r in reqs:
+                direct[i] |= 1 << self.position[r]
+
+        # REQUIREMENTS ARE EARLIER IN order, SO THEIR CLOSURE IS ALREADY KNOWN
+        self._requirements = [0] * size
+        for i in range(size):
+            bits = 1 << i
+            reqs = direct[i]
+            while reqs:
+                low = reqs & -reqs
+                bits |= self._requirements[low.bit_length() - 1]
+                reqs ^= low
+            self._requirements[i] = bits
+
+        # DEPENDENTS ARE LATER IN order
+        self._dependents = [1 << i for i in range(size)]
+        for i in reversed(range(size)):
+            reqs = direct[i]
+            while reqs:
+                low = reqs & -reqs
+                self._dependents[low.bit_length() - 1] |= self._dependents[i]
+                reqs ^= low
+
+    def __contains__(self, name):
+        return name in self.position
+
+    def requirement_bits(self, names):
+        """
+        :return: BITSET OF EVERYTHING names (TRANSITIVELY) REQUIRE, INCLUDING names
+        """
+        bits = 0
+        for name in listwrap(names):
+            bits |= self._requirements[self._position_of(name)]
+        return bits
+
+    def dependent_bits(self, names):
+        """
+        :return: BITSET OF EVERYTHING THAT (TRANSITIVELY) REQUIRES names, INCLUDING names
+        """
+        bits = 0
+        for name in listwrap(names):
+            bits |= self._dependents[self._position_of(name)]
+        return bits
+
+    def requires(self, name, requirement):
+        """
+        :return: True IF name NEEDS requirement, DIRECTLY OR NOT (OR IS requirement)
+        """
+        return bool(self._requirements[self._position_of(name)] >> self._position_of(requirement) & 1)
+
+    def requirements(self, names):
+        """
+        :return: NAMES OF EVERYTHING names (TRANSITIVELY) REQUIRE, INCLUDING names, IN TOPOLOGICAL ORDER
+        """
+        return self.names(self.requirement_bits(names))
+
+    def dependents(self, names):
+        """
+        :return: NAMES OF EVERYTHING THAT (TRANSITIVELY) REQUIRES names, INCLUDING names, IN TOPOLOGICAL ORDER
+        """
+        return self.names(self.dependent_bits(names))
+
+    def must_release(self, changed, managed):
+        """
+        :param changed: NAMES OF THE PACKAGES THAT CHANGED
+        :param managed: THE PACKAGES WE RELEASE
+        :return: MANAGED PACKAGES TO RE-RELEASE IF changed ARE RELEASED, IN TOPOLOGICAL ORDER
+        """
+        return self.names(self.dependent_bits(changed) & self.bits(managed))
+
+    def bits(self, names):
+        """
+        :return: BITSET OF THE KNOWN names
+        """
+        bits = 0
+        for name in names:
+            i = self.position.get(name)
+            if i is not None:
+                bits |= 1 << i
+        return bits
+
+    def names(self, bits):
+        """
+        :return: NAMES IN THE BITSET, IN TOPOLOGICAL ORDER
+        """
+        output = []
+        while bits:
+            low = bits & -bits
+            output.append(self.order[low.bit_length() - 1])
+            bits ^= low
+        return output
+
+    def _position_of(self, name):
+        i = self.position.get(name)
+        if i is None:
+            logger.error("{name} is not in the dependency graph", name=name)
+        return i
@@ -0,0 +1,160 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import subprocess
+from collections import OrderedDict
+
+from mo_deploy.trace import tracer, GIT
+from mo_files import File
+from mo_json import json2value
+from mo_logs import logger
+from mo_threads import Lock
+
+DEBUG = False
+MAX_SETUPS = 200  # NUMBER OF PARSED setuptools.json TO KEEP, PER REPOSITORY
+
+readers_locker = Lock("git readers")
+readers = {}
+
+
+def get_reader(git, directory):
+    """
+    RETURN THE ONE GitReader FOR THIS REPOSITORY
+    """
+    key = File(directory).abs_path
+    with readers_locker:
+        reader = readers.get(key)
+        if not reader:
+            reader = readers[key] = GitReader(git, directory)
+        return reader
+
+
+def close_all():
+    with readers_locker:
+        all_readers = list(readers.values())
+        readers.clear()
+    for r in all_readers:
+        r.close()
+
+
+class GitReader(object):
+    """
+    ONE LONG-LIVED `git cat-file --batch` PROCESS FOR READING OBJECTS FROM A REPOSITORY
+    SO EACH LOOKUP IS A LINE WRITTEN TO A PIPE, NOT A NEW PROCESS
+    """
+
+    def __init__(self, git, directory, max_setups=MAX_SETUPS):
+        self.git = git
+        self.directory = File(directory)
+        self.locker = Lock("git reader for " + self.directory.abs_path)
+        self.process = None
+        self.max_setups = max_setups
+        self.setups = OrderedDict()  # LRU OF PARSED setuptools.json, BY BLOB HASH
+
+    def _start(self):
+        DEBUG and logger.info("start cat-file for {dir}", dir=self.directory.abs_path)
+        self.process = subprocess.Popen(
+            [str(self.git), "cat-file", "--batch"],
+            cwd=self.directory.os_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def read(self, object_name):
+        """
+        :param object_name: ANYTHING git rev-parse ACCEPTS, LIKE "v1.2.3:packaging/setuptools.json"
+        :return: (hash, type, content) TRIPLE, OR None IF NOT FOUND
+        """
+        with tracer.span("cat-file", GIT, object=object_name), self.locker:
+            for attempt in range(2):
+                if not self.process or self.process.poll() is not None:
+                    self._start()
+                try:
+                    self.process.stdin.write(object_name.encode("utf8") + b"\n")
+                    self.process.stdin.flush()
+                    header = self.process.stdout.readline().decode("utf8").strip()
+                    if not header:
+                        raise Exception("cat-file closed")
+                    break
+                except Exception as cause:
+                    if attempt:
+                        logger.error(
+                            "Can not read {object} from {dir}", object=object_name, dir=self.directory.abs_path, cause=cause,
+                        )
+                    self._close()
+
+            if header.endswith(" missing") or header.endswith(" ambiguous"):
+                DEBUG and logger.info("{object} not found", object=object_name)
+                return None
+            object_hash, object_type, size = header.split(" ")
+            content = self._read_exactly(int(size))
+            self._read_exactly(1)  # TRAILING NEWLINE
+            return object_hash, object_type, content
+
+    def _read_exactly(self, size):
+        output = []
+        while size:
+            data = self.process.stdout.read(size)
+            if not data:
+                logger.error("cat-file closed early for {dir}", dir=self.directory.abs_path)
+            output.append(data)
+            size -= len(data)
+        return b"".join(output)
+
+    def read_blob(self, revision, path):
+        """
+        :return: FILE CONTENT (bytes) AT revision, OR None IF NOT FOUND
+        """
+        result = self.read(f"{revision}:{path}")
+        if result is None:
+            return None
+        return result[2]
+
+    def commit_of(self, revision):
+        """
+        :return: COMMIT HASH THE REVISION (TAG, BRANCH, ...) POINTS TO, OR None IF NOT FOUND
+        """
+        result = self.read(f"{revision}^{{commit}}")
+        if result is None:
+            return None
+        return result[0]
+
+    def read_json(self, revision, path):
+        """
+        :return: PARSED JSON AT revision, OR None IF NOT FOUND
+        """
+        result = self.read(f"{revision}:{path}")
+        if result is None:
+            return None
+        blob_hash, _, content = result
+        with self.locker:
+            value = self.setups.get(blob_hash)
+            if value is not None:
+                self.setups.move_to_end(blob_hash)
+                return value
+        value = json2value(content.decode("utf8"), leaves=False)
+        with self.locker:
+            self.setups[blob_hash] = value
+            while len(self.setups) > self.max_setups:
+                self.setups.popitem(last=False)
+        return value
+
+    def _close(self):
+        process, self.process = self.process, None
+        if not process:
+            return
+        try:
+            process.stdin.close()
+            process.wait(timeout=10)
+        except Exception:
+            process.kill()
+
+    def close(self):
+        with self.locker:
+            self._close()
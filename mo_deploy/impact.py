@@ -0,0 +1,150 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import ast
+import fnmatch
+import os
+
+from mo_files import File
+from mo_logs import logger
+
+DEBUG = False
+TESTS = "tests"
+TEST_PATTERN = "test*.py"  # SAME AS test_runner
+# CHANGES TO THESE CAN NOT CHANGE A TEST RESULT
+IRRELEVANT_FILES = ["README*", "*.md", "*.rst", "LICENSE*", ".gitignore", ".travis.yml", "setup.py"]
+IRRELEVANT_DIRS = [".github/", "docs/", "vendor/"]
+
+
+class ImportGraph(object):
+    """
+    WHICH TEST MODULES (TRANSITIVELY) IMPORT WHICH FILES OF THE PACKAGE
+
+    ONLY THE PACKAGE DIRECTORIES AND THE tests/ DIRECTORY ARE PARSED; IMPORTS OF ANYTHING ELSE ARE IGNORED
+    """
+
+    def __init__(self, directory, packages):
+        """
+        :param directory: ROOT OF THE REPOSITORY
+        :param packages: TOP-LEVEL PACKAGE DIRECTORIES, LIKE ["mo_dots"]
+        """
+        self.directory = File(directory)
+        self.packages = sorted(set(p.split(".")[0] for p in packages))
+        self.names = {}  # MAP FROM MODULE NAME TO PATH (RELATIVE TO directory)
+        self.importers = {}  # MAP FROM PATH TO SET OF PATHS THAT IMPORT IT
+        self.tests = {}  # MAP FROM TEST PATH TO NAME USED BY test_runner
+
+        paths = self.paths = []
+        for root in self.packages + [TESTS]:
+            for path in _python_files(self.directory.os_path, root):
+                paths.append(path)
+                for name in _module_names(path):
+                    self.names[name] = path
+                if path.startswith(TESTS + "/") and fnmatch.fnmatch(path.split("/")[-1], TEST_PATTERN):
+                    self.tests[path] = path[len(TESTS) + 1 : -3].replace("/", ".")
+        for path in paths:
+            for imported in self._imports_of(path):
+                self.importers.setdefault(imported, set()).add(path)
+
+    def _imports_of(self, path):
+        try:
+            tree = ast.parse((self.directory / path).read_bytes(), filename=path)
+        except Exception as cause:
+            logger.warning("Can not parse {path}", path=path, cause=cause)
+            return set()
+        package = _module_names(path)[0].split(".")
+        if not path.endswith("__init__.py"):
+            package = package[:-1]
+
+        found = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    found.update(self._resolve(alias.name))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    base = package[: len(package) - node.level + 1]
+                    parent = ".".join(base + ([node.module] if node.module else []))
+                else:
+                    parent = node.module
+                found.update(self._resolve(parent))
+                for alias in node.names:
+                    # from package import submodule
+                    found.update(self._resolve(f"{parent}.{alias.name}", exact=True))
+        found.discard(path)
+        return found
+
+    def _resolve(self, name, exact=False):
+        """
+        :return: PATHS OF THE KNOWN MODULES THAT ARE RUN WHEN name IS IMPORTED (THE MODULE AND ITS PARENT PACKAGES)
+        """
+        if not name:
+            return []
+        steps = name.split(".")
+        prefixes = [steps] if exact else [steps[:i] for i in range(1, len(steps) + 1)]
+        return [self.names[n] for n in (".".join(p) for p in prefixes) if n in self.names]
+
+    def impacted_tests(self, changed_files):
+        """
+        :param changed_files: PATHS (RELATIVE TO directory, WITH /) THAT CHANGED
+        :return: SORTED LIST OF TEST MODULE NAMES THAT COULD SEE THE CHANGE, OR None IF ALL TESTS MUST RUN
+        """
+        known = set(self.paths)
+        todo = []
+        for path in changed_files:
+            if path in known:
+                todo.append(path)
+            elif path.endswith(".py") and not any(path.startswith(p + "/") for p in self.packages + [TESTS]):
+                # SCRIPT OUTSIDE THE PACKAGE, NOT IMPORTED BY TESTS
+                continue
+            elif _is_irrelevant(path):
+                continue
+            else:
+                # DATA FILES, setuptools.json, REQUIREMENTS, DELETED MODULES: ANYTHING MAY HAPPEN
+                DEBUG and logger.info("{path} changed, so run all tests", path=path)
+                return None
+
+        seen = set(todo)
+        while todo:
+            path = todo.pop()
+            for importer in self.importers.get(path, ()):
+                if importer not in seen:
+                    seen.add(importer)
+                    todo.append(importer)
+        return sorted(self.tests[p] for p in seen if p in self.tests)
+
+
+def _python_files(root, directory):
+    """
+    :return: PATHS (RELATIVE TO root, WITH /) OF ALL .py FILES UNDER directory
+    """
+    for path, dirs, files in os.walk(os.path.join(root, directory)):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d != "__pycache__"]
+        relative = os.path.relpath(path, root).replace(os.sep, "/")
+        for f in files:
+            if f.endswith(".py"):
+                yield f"{relative}/{f}"
+
+
+def _module_names(path):
+    """
+    :return: NAMES THE FILE CAN BE IMPORTED AS; TESTS ARE RUN WITH BOTH . AND tests/ ON THE PATH
+    """
+    steps = path[:-3].split("/")
+    if steps[-1] == "__init__":
+        steps = steps[:-1]
+    names = [".".join(steps)]
+    if steps[0] == TESTS and len(steps) > 1:
+        names.append(".".join(steps[1:]))
+    return names
+
+
+def _is_irrelevant(path):
+    if any(path.startswith(d) for d in IRRELEVANT_DIRS):
+        return True
+    return any(fnmatch.fnmatch(path.split("/")[-1], p) for p in IRRELEVANT_FILES)
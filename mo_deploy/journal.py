@@ -0,0 +1,105 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import hashlib
+
+from mo_dots import from_data
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import logger
+from mo_threads import Lock
+
+DEBUG = False
+PHASES = ["version", "tests", "upload", "publish"]  # IN ORDER; REDOING ONE INVALIDATES THE ONES AFTER
+
+
+class Journal(object):
+    """
+    THE COMPLETED deploy PHASES OF ONE MODULE VERSION, SO A FAILED deploy CAN RESUME
+
+    EACH ENTRY HAS THE dev REVISION BEFORE AND AFTER THE PHASE, ANY OUTPUTS, AND THE sha256 OF
+    ITS ARTIFACTS. A PHASE IS DONE IF dev IS STILL AT ITS after REVISION (OR WHERE THE PHASES
+    AFTER IT MOVED dev) AND THE ARTIFACTS ARE UNCHANGED; OTHERWISE IT, AND EVERY PHASE AFTER IT,
+    IS RUN AGAIN
+    """
+
+    def __init__(self, file, version):
+        self.file = File(file)
+        self.version = str(version)
+        self.locker = Lock("journal " + self.file.abs_path)
+        self.phases = {}
+        if self.file.exists:
+            try:
+                data = from_data(json2value(self.file.read()))
+                if data["version"] == self.version:
+                    self.phases = data["phases"]
+            except Exception as cause:
+                logger.warning("Ignoring corrupt journal {file}", file=self.file.abs_path, cause=cause)
+
+    def completed(self, phase, revision, artifacts=None):
+        """
+        :param phase: ONE OF PHASES
+        :param revision: THE dev REVISION NOW
+        :param artifacts: DIRECTORY OF FILES THE PHASE MADE
+        :return: THE outputs OF THE PHASE, IF IT IS DONE, ELSE None
+        """
+        with self.locker:
+            entry = self.phases.get(phase)
+            later = [self.phases.get(p) for p in PHASES[PHASES.index(phase) + 1 :]]
+        if not entry:
+            return None
+        # LATER PHASES MAY COMMIT TO dev, SO FOLLOW THEM FROM WHERE THIS ONE LEFT dev
+        last = entry["after"]
+        for e in later:
+            if not e or e["before"] != last:
+                break
+            last = e["after"]
+        if last != revision:
+            DEBUG and logger.info("{phase} is stale: dev moved", phase=phase)
+            return None
+        if artifacts is not None and entry["artifacts"] != hash_files(artifacts):
+            DEBUG and logger.info("{phase} is stale: artifacts changed", phase=phase)
+            return None
+        return entry["outputs"]
+
+    def record(self, phase, before, after, artifacts=None, **outputs):
+        """
+        :param before: dev REVISION WHEN THE PHASE STARTED
+        :param after: dev REVISION WHEN THE PHASE ENDED
+        :param artifacts: DIRECTORY OF FILES THE PHASE MADE
+        :param outputs: JSON-ABLE VALUES TO RESTORE WHEN THE PHASE IS SKIPPED
+        """
+        with self.locker:
+            for later in PHASES[PHASES.index(phase) + 1 :]:
+                self.phases.pop(later, None)
+            self.phases[phase] = {
+                "before": before,
+                "after": after,
+                "artifacts": hash_files(artifacts) if artifacts is not None else None,
+                "outputs": outputs,
+            }
+            self.file.write(value2json({"version": self.version, "phases": self.phases}, pretty=True))
+
+    def clear(self):
+        with self.locker:
+            self.phases = {}
+            self.file.delete()
+
+
+def hash_files(directory):
+    """
+    :return: MAP FROM FILE NAME TO sha256 OF EACH FILE IN directory
+    """
+    output = {}
+    for f in File(directory).walk():
+        digest = hashlib.sha256()
+        with open(f.os_path, "rb") as stream:
+            for block in iter(lambda: stream.read(2 ** 16), b""):
+                digest.update(block)
+        output[f.path] = digest.hexdigest()
+    return output
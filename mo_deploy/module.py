@@ -6,21 +6,32 @@
 #
 # Author: Kyle Lahnakoski (kyle@lahnakoski.com)
 #
+import hashlib
+import os
+
 from mo_future import Mapping
 
-from mo_deploy.utils import Requirement, parse_req
+from mo_deploy import git_reader
+from mo_deploy.impact import ImportGraph
+from mo_deploy.journal import Journal
+from mo_deploy.package_index import PYPI
+from mo_deploy.state_store import stored, refs_signatures, moves_refs
+from mo_deploy.svn_sync import find_working_copies, sync_working_copies
+from mo_deploy.test_runner import BAD as BAD_TEST_STATUS
+from mo_deploy.trace import tracer, COMMAND, WAIT
+from mo_deploy.utils import Requirement, parse_req, ask
+from mo_deploy.venv_pool import venv_python, MAX_BYTES
 from mo_dots import coalesce, listwrap, to_data, exists, from_data
-from mo_dots.lists import last
-from mo_files import File, TempDirectory, URL
-from mo_future import is_binary, is_text, sort_using_key, text, first
-from mo_http import http
+from mo_files import File, TempDirectory
+from mo_future import is_binary, is_text, sort_using_key, text
 from mo_json import value2json, json2value
 from mo_json_config import ini2value
 from mo_logs import Except, logger, strings
-from mo_math import randoms
 from mo_threads import Thread, Till, Lock, lock
+from mo_threads.capture import Capture
 from mo_threads.commands import Command
-from mo_times import Timer, Date
+from mo_threads.governor import CPU_HEAVY, IO_HEAVY, NETWORK, governor
+from mo_times import Timer, Date, HOUR
 from mo_times.dates import ISO8601
 from pyLibrary.meta import cache
 from pyLibrary.utils import Version
@@ -30,6 +41,18 @@ FIRST_VERSION = Version("0.0.0")
 SETUPTOOLS = "packaging/setuptools.json"  # CONFIGURATION USED TO MAKE THE setup.py FILE
 SVN_BRANCH = "svn"
 TEMP_BRANCH_PREFIX = "temp-"
+PUBLISH_TIMEOUT = 90  # SECONDS TO WAIT FOR NEW VERSION TO SHOW ON THE INDEX
+TEST_RUNNER = File(__file__).parent / "test_runner.py"  # RUN INSIDE THE TEST virtualenv
+VCS_DIRECTORIES = [".git/", ".svn/", ".hg/"]
+NOT_PACKAGES = VCS_DIRECTORIES + ["/tests/", "/vendor/", "/.*/"]  # DIRECTORIES THAT DO NOT HOLD RELEASED PACKAGES
+# LOOKED FOR IN pip OUTPUT AS IT ARRIVES
+INSTALL_PROBLEMS = {
+    "incompatible": "which is incompatible",
+    "conflicting": "conflicting dependencies",
+    "index file": "unable to write new index file",
+    "content type": "because the GET request got Content-Type",
+    "pip version": 'pip\\_vendor\\packaging\\version.py", line 264, in __init__',
+}
 
 
 class Module(object):
@@ -37,9 +60,15 @@ class Module(object):
     git = "git"
     svn = "svn"
     twine = "twine"
+    index_url = PYPI  # PYPI-LIKE JSON API, OR file://<directory> WITH THE SAME LAYOUT
+    venv_pool_bytes = MAX_BYTES  # DISK USE OF POOLED virtualenvs
     python = {"3.11": "c:/python311/python.exe"}
     ignore_svn = []
     test_versions = []
+    test_workers = None  # PROCESSES PER TEST RUN, DEFAULT IS TO SHARE THE CPUS AMONG test_versions
+    test_impact = False  # True TO RUN ONLY THE TESTS IMPACTED BY THE CHANGES, EXCEPT ON THE LOWEST PYTHON VERSION
+    state_directory = "~/.mo-deploy"  # WHERE TO KEEP STATE BETWEEN RUNS
+    state = None  # StateStore FOR PROBES, SET BY main()
 
     def __init__(self, info, graph):
         if isinstance(info, Mapping):
@@ -57,56 +86,97 @@ class Module(object):
             self.name = self.directory.stem.replace("_", "-")
             self.package_name = self.name
         self.graph = graph
-        self.all_versions = []
         # setattr(lock, "print", lambda x: logger.info(x, static_template=False, stack_depth=1))
         self.install_locker = Lock("only one pip installer at a time")
+        self.priority = 0  # HIGHER GETS CPU, DISK AND NETWORK FIRST (SEE Scheduler)
 
-    def deploy(self):
-        self.setup()
-        self.svn_update()
-        self.update_dev("updates from other projects")
+    def deploy(self, before_upload=None):
+        """
+        :param before_upload: FUNCTION TO CALL AFTER TESTS PASS AND THE WHEEL IS BUILT, BUT BEFORE UPLOAD
+        """
+        with tracer.phase("sync", module=self.name):
+            self.setup()
+            self.svn_update()
+            self.update_dev("updates from other projects")
 
         curr_version, revision = self.get_version()
         next_version = self.graph.get_next_version(self.name)
         if curr_version == next_version:
             logger.error("{{module}} does not need deploy", module=self.name)
 
+        # PHASES DONE BY AN EARLIER, FAILED, deploy OF THIS VERSION ARE NOT DONE AGAIN
+        journal = Journal(File(self.state_directory) / "journal" / f"{self.name}.json", next_version)
         master_rev = self.master_revision()
         try:
-            self.update_setup_json_file(next_version)
-            self.synch_travis_file()
-            self.gen_setup_py_file()
-            # TOO SOON TO RUN THIS, MUST HAVE THE DEPENDENCIES INSTALLED FIRST
-            # logger.info("if you are stalled here, it is because import __deploy__ may have imported mo_threads and now has an active thread that has not been told to shutdown")
-            # self.local(
-            #     [
-            #         self.python["latest"],
-            #         "-c",
-            #         "from " + self.package_name.replace("-", "_") + " import __deploy__; __deploy__()",
-            #     ],
-            #     raise_on_error=False,
-            # )
-            self.update_dev("update version number")
-
-            # RUN TESTS IN PARALLEL
-            while True:
-                try:
-                    test_threads = [Thread.run("test " + v, self.run_tests, v) for v in self.test_versions]
-                    Thread.join_all(test_threads)
-                    # for v in self.test_versions:
-                    #     self.run_tests(v, None)
-                    break
-                except Exception as cause:
-                    logger.warning("Tests did not pass", cause=cause)
-                    value = input("Did not pass tests.  Try again? (y/N): ")
-                    if value not in "yY":
-                        logger.error("Can not install self", cause=cause)
-            self.update_dev("update lockfile")  # ONE OF THE TEST THREADS UPDATED THE REQUIREMENTS FILE
-            self.update_master_locally(next_version)
-            self.pypi()
-            self.local([self.git, "push", "origin", self.master_branch])
+            before = self.dev_revision()
+            done = journal.completed("version", before)
+            if done is not None:
+                logger.info("Resume {module}: version is already {version}", module=self.name, version=next_version)
+                self.test_versions = done["test_versions"]
+            else:
+                with tracer.phase("version", module=self.name):
+                    self.update_setup_json_file(next_version)
+                    self.synch_travis_file()
+                    self.gen_setup_py_file()
+                    # TOO SOON TO RUN THIS, MUST HAVE THE DEPENDENCIES INSTALLED FIRST
+                    # logger.info("if you are stalled here, it is because import __deploy__ may have imported mo_threads and now has an active thread that has not been told to shutdown")
+                    # self.local(
+                    #     [
+                    #         self.python["latest"],
+                    #         "-c",
+                    #         "from " + self.package_name.replace("-", "_") + " import __deploy__; __deploy__()",
+                    #     ],
+                    #     raise_on_error=False,
+                    # )
+                    self.update_dev("update version number")
+                journal.record("version", before, self.dev_revision(), test_versions=self.test_versions)
+
+            before = self.dev_revision()
+            if journal.completed("tests", before, artifacts=self.dist_directory) is not None:
+                logger.info("Resume {module}: tests already passed on the built wheel", module=self.name)
+            else:
+                # RUN TESTS IN PARALLEL
+                while True:
+                    try:
+                        with tracer.phase("build", module=self.name):
+                            self.build()
+                        test_modules = self.select_tests()
+                        test_threads = [
+                            Thread.run("test " + v, self.run_tests, v, test_modules=test_modules.get(v))
+                            for v in self.test_versions
+                        ]
+                        Thread.join_all(test_threads)
+                        # for v in self.test_versions:
+                        #     self.run_tests(v, None)
+                        break
+                    except Exception as cause:
+                        logger.warning("Tests did not pass", cause=cause)
+                        value = ask("Did not pass tests.  Try again? (y/N): ")
+                        if value not in "yY":
+                            logger.error("Can not install self", cause=cause)
+                with tracer.phase("release", module=self.name):
+                    self.update_dev("update lockfile")  # ONE OF THE TEST THREADS UPDATED THE REQUIREMENTS FILE
+                journal.record("tests", before, self.dev_revision(), artifacts=self.dist_directory)
+            # TESTS PASSED, SO DEPENDENTS MAY USE THIS WHEEL NOW
+            self.graph.wheelhouse.deposit(self.package_name, self.dist_directory)
+            with tracer.phase("release", module=self.name):
+                self.update_master_locally(next_version)
+
+            before = self.dev_revision()
+            if journal.completed("publish", before, artifacts=self.dist_directory) is not None:
+                logger.info("Resume {module}: {version} is already uploaded", module=self.name, version=next_version)
+            else:
+                with tracer.phase("publish", module=self.name):
+                    self.pypi(before_upload, journal)
+                journal.record("publish", before, before, artifacts=self.dist_directory)
+            with tracer.phase("push", module=self.name):
+                self.graph.push_queue.push(self, self.master_branch)
+            journal.clear()
         except Exception as cause:
             cause = Except.wrap(cause)
+            # THE LOCAL TAG AND master ARE ROLLED BACK, SO MUST NOT BE PUSHED
+            self.graph.push_queue.discard(self, [text(next_version)], tag=True)
+            self.graph.push_queue.discard(self, [self.master_branch])
             self.local([self.git, "checkout", "-f", master_rev])
             self.local(
                 [self.git, "tag", "--delete", text(next_version)], raise_on_error=False,
@@ -163,21 +233,30 @@ class Module(object):
         (self.directory / "packaging" / "setup.py").write(content)
         (self.directory / "setup.py").write(content)
 
-    @cache()
+    @cache(lock=True)
+    @stored(
+        encode=lambda v: None if v is NO_VERSION else str(v),
+        decode=lambda v: NO_VERSION if v is None else Version(v),
+        max_age=HOUR,  # pypi MAY HAVE CHANGED WITHOUT ANY CHANGE TO THE REPOSITORY
+    )
     def last_deploy(self):
-        url = URL("https://pypi.org/pypi") / self.package_name / "json"
+        index = self.graph.index
         try:
-            result = http.get_json(url)
-            version = max(
-                v
-                for k in result.releases.keys()
-                for v in [Version(k, prefix="v")]
-                if v.major == self.get_major_version()
-            )
+            version = index.latest(self.package_name, major=self.get_major_version())
+            if version is None:
+                logger.warning(
+                    "Is this new? No {{package}} versions found on {{url}}", package=self.package_name, url=index.url,
+                )
+                return NO_VERSION
             logger.info("last deployed version is {{version}}", version=version)
             return version
         except Exception as e:
-            logger.warning("Is this new? Could not get version from {{url}}", url=url, cause=e)
+            logger.warning(
+                "Is this new? Could not get {{package}} version from {{url}}",
+                package=self.package_name,
+                url=index.url,
+                cause=e,
+            )
             return NO_VERSION
 
     def scrub_pypi_residue(self):
@@ -189,11 +268,11 @@ class Module(object):
                 (self.directory / "dist").delete()
                 (self.directory / (self.directory.stem.replace("-", "_") + ".egg-info")).delete()
 
-                for f in self.directory.leaves:
+                for f in self.directory.walk(ignore=VCS_DIRECTORIES):
                     if f.extension == "pyc":
-                        f.delete()
+                        os.remove(f.os_path)
 
-    def pypi(self):
+    def pypi(self, before_upload=None, journal=None):
         # ENSURE THE API TOKEN IS SET.  twine USES keyring:
         #     C:\Users\kyle>keyring get https://upload.pypi.org/legacy/ __token__
         #
@@ -203,28 +282,25 @@ class Module(object):
 
         logger.info("Update PyPi for {{dir}}", dir=self.directory.abs_path)
         try:
-            self.scrub_pypi_residue()
-
-            # INSTRUCTIONS FOR USE OF pyproject.toml
-            # pip install pep517
-            # python -m pep517.build .
-            # python setup.py --version
-            #
-            # pyproject.toml
-            # [build-system]
-            # requires = ["setuptools", "wheel"]
-            # build-backend = "setuptools.build_meta"
-
-            logger.info("run build command")
-            self.gen_setup_py_file()
-
-            # self.local([self.python["latest"], "setup.py", "bdist_wheel", "--universal"], raise_on_error=True)
-            self.local([self.python["latest"], "-m", "build", "--wheel", "--sdist"], raise_on_error=True)
+            if before_upload:
+                before_upload()
+
+            skip_existing = []
+            if journal:
+                # ONLY THESE SAME FILES, FROM AN UPLOAD THAT FAILED PART WAY, MAY ALREADY BE ON THE INDEX
+                before = self.dev_revision()
+                if journal.completed("upload", before, artifacts=self.dist_directory) is not None:
+                    logger.info("Resume upload of {{module}}", module=self.name)
+                    skip_existing = ["--skip-existing"]
+                journal.record("upload", before, before, artifacts=self.dist_directory)
 
             logger.info("twine upload of {{dir}}", dir=self.directory.abs_path)
             # python3 -m twine upload --repository-url https://test.pypi.org/legacy/ dist/*
+            # UPLOAD THE SAME FILES THAT WERE TESTED
             process, stdout, stderr = self.local(
-                [self.twine, "upload", "--verbose", "dist/*"], raise_on_error=False, show_all=True,
+                [self.twine, "upload", "--verbose", *skip_existing, self.dist_directory / "*"],
+                raise_on_error=False,
+                show_all=True,
             )
             if "Upload failed (400): File already exists." in stderr:
                 logger.error("Version exists. Not uploaded")
@@ -241,31 +317,64 @@ class Module(object):
             elif "503: Service Unavailable" in stderr:
                 logger.error("Some big problem during upload")
             else:
-                logger.error("not expected\n{{result}}", result=stdout + stderr)
+                logger.error("not expected\n{{result}}", result=(stdout, stderr))
         finally:
             self.scrub_pypi_residue()
 
-        give_up_on_pypi = Till(seconds=90)
-        while not give_up_on_pypi:
-            logger.info(
-                "WAIT FOR PYPI TO SHOW NEW VERSION {{module}}=={{version}}",
+        version = self.graph.get_next_version(self.name)
+        logger.info(
+            "WAIT FOR PYPI TO SHOW NEW VERSION {{module}}=={{version}}", module=self.package_name, version=version,
+        )
+        timeout = Till(seconds=PUBLISH_TIMEOUT)
+        found = self.graph.publish_waiter.expect(self.package_name, version, till=timeout)
+        with tracer.span("wait for index", WAIT, package=self.package_name, version=str(version)):
+            found.wait(till=timeout)
+        if found:
+            logger.info("Found on pypi")
+        else:
+            logger.warning(
+                "{{module}}=={{version}} not seen on pypi after {{timeout}} seconds",
                 module=self.package_name,
-                version=self.graph.get_next_version(self.name),
+                version=version,
+                timeout=PUBLISH_TIMEOUT,
             )
-            Till(seconds=10).wait()
-            """
-            (.venv) C:\\Users\\kyle\\code\\mo-sql-parsing>pip install mo-collections==
-            ERROR: Could not find a version that satisfies the requirement mo-collections== (from versions: 1.0.17035, 1.0.17036, 1.0.17039, 1.1.17039, 1.1.17040, 1.1.17041, 1.1.17049, 1.1.17056, 1.1.17085, 1.1.17131, 1.1.17227, 1.1.17229, 1.2.17235, 1.2.18029, 2.13.18154, 2.15.18155, 2.16.18199, 2.17.18212, 2.18.18240, 2.26.18331, 2.31.19025, 3.5.19316, 3.38.20029, 3.46.20032, 3.58.20089, 3.60.20091, 3.77.20190, 3.96.20290, 4.3.20340, 4.30.21121, 5.37.21239, 5.45.21241)
-            ERROR: No matching distribution found for mo-collections==
-            WARNING: You are using pip version 20.1.1; however, version 21.2.4 is available.
-            You should consider upgrading via the 'c:\\python37\\python.exe -m pip install --upgrade pip' command.
-            """
-            p, stdout, stderr = self.local(
-                [self.python["latest"], "-m", "pip", "install", self.package_name + "=="], raise_on_error=False,
+
+    @property
+    def dist_directory(self):
+        return File(self.state_directory) / "dist" / self.name
+
+    def build(self):
+        """
+        BUILD sdist AND wheel ONCE PER VERSION; THE wheel IS INSTALLED FOR TESTING AND BOTH ARE UPLOADED
+        """
+        # INSTRUCTIONS FOR USE OF pyproject.toml
+        # pip install pep517
+        # python -m pep517.build .
+        # python setup.py --version
+        #
+        # pyproject.toml
+        # [build-system]
+        # requires = ["setuptools", "wheel"]
+        # build-backend = "setuptools.build_meta"
+        logger.info("run build command")
+        try:
+            self.scrub_pypi_residue()
+            self.dist_directory.delete()
+            self.gen_setup_py_file()
+            # self.local([self.python["latest"], "setup.py", "bdist_wheel", "--universal"], raise_on_error=True)
+            self.local(
+                [self.python["latest"], "-m", "build", "--wheel", "--sdist", "--outdir", self.dist_directory],
+                raise_on_error=True,
             )
-            if any(str(self.graph.get_next_version(self.name)) in e for e in stderr):
-                logger.info("Found on pypi")
-                break
+        finally:
+            self.scrub_pypi_residue()
+
+    @property
+    def wheel(self):
+        wheels = [f for f in self.dist_directory.children if f.extension == "whl"]
+        if len(wheels) != 1:
+            logger.error("Expecting one wheel in {dir}", dir=self.dist_directory.abs_path)
+        return wheels[0]
 
     def update_setup_json_file(self, new_version):
         setup_json = self.directory / SETUPTOOLS
@@ -297,13 +406,13 @@ class Module(object):
                     self.test_versions.append(version)
         if "3.11" not in self.test_versions:
             # ask user if they want to add 3.11
-            value = input("Add 3.11 python to supported versions list? (y/N): ")
+            value = ask("Add 3.11 python to supported versions list? (y/N): ")
             if value in "yY":
                 self.test_versions.append("3.11")
                 setup.classifiers.append("Programming Language :: Python :: 3.11")
         if "3.12" not in self.test_versions:
             # ask user if they want to add 3.12
-            value = input("Add 3.12 python to supported versions list? (y/N): ")
+            value = ask("Add 3.12 python to supported versions list? (y/N): ")
             if value in "yY":
                 self.test_versions.append("3.12")
                 setup.classifiers.append("Programming Language :: Python :: 3.12")
@@ -316,15 +425,9 @@ class Module(object):
 
         # PACKAGES
         expected_packages = [
-            dir_name.replace("/", ".")
-            for f in self.directory.leaves
-            if f.stem == "__init__" and f.extension == "py"
-            for dir_name in [f.parent.abs_path[len(self.directory.abs_path) + 1 :]]
-            if dir_name
-            and not dir_name.startswith("tests/")
-            and not dir_name.startswith(".")
-            and not dir_name.startswith("vendor/")
-            and dir_name != "tests"
+            f.parent.replace("/", ".")
+            for f in self.directory.walk(ignore=NOT_PACKAGES)
+            if f.name == "__init__.py" and f.parent
         ]
         package_dir = coalesce(setup.package_dir[""] + "/", "")
         declared_packages = [package_dir + p for p in setup.packages]
@@ -372,15 +475,7 @@ class Module(object):
 
         self.local([self.git, "merge", self.dev_branch])
 
-        for d in self.directory.find(r"\.svn"):
-            svn_dir = d.parent.os_path
-            if any(d in svn_dir for d in listwrap(Module.ignore_svn)):
-                logger.info("Ignoring svn directory {{dir}}", dir=svn_dir)
-                continue
-
-            logger.info("Update svn directory {{dir}}", dir=svn_dir)
-            self.local([self.svn, "update", "--accept", "p", svn_dir])
-            self.local([self.svn, "commit", svn_dir, "-m", "auto"])
+        sync_working_copies(self, find_working_copies(self.directory, Module.ignore_svn))
 
         self.local([self.git, "checkout", self.dev_branch])
         self.local([self.git, "merge", self.svn_branch])
@@ -394,12 +489,7 @@ class Module(object):
             pass
         else:
             logger.error("not expected {{result}}", result=(stdout, stderr))
-        try:
-            self.local([self.git, "push", "origin", self.dev_branch])
-        except Exception as e:
-            logger.warning(
-                "git origin dev not updated for {{dir}}", dir=self.directory.abs_path, cause=e,
-            )
+        self.graph.push_queue.push(self, self.dev_branch)
 
     def update_master_locally(self, version):
         logger.info("Update git master branch for {{dir}}", dir=self.directory.abs_path)
@@ -409,45 +499,58 @@ class Module(object):
             self.local([self.git, "merge", "--no-ff", "--no-commit", self.dev_branch])
             self.local([self.git, "commit", "-m", "release " + v])
             self.local([self.git, "tag", v])
-            self.local([self.git, "push", "--delete", "origin", v], raise_on_error=False)
-            self.local([self.git, "push", "origin", v])
+            # REPLACES ANY TAG OF THE SAME NAME ON origin
+            self.graph.push_queue.push(self, v, tag=True, force=True)
         except Exception as e:
             logger.error(
                 "git origin master not updated for {{dir}}", dir=self.directory.stem, cause=e,
             )
 
-    def run_tests(self, python_version, please_stop):
+    def select_tests(self):
+        """
+        :return: MAP FROM PYTHON VERSION TO THE TEST MODULES IT RUNS (MISSING MEANS ALL TESTS)
+        THE LOWEST VERSION ALWAYS RUNS ALL TESTS, IT ALSO WRITES THE LOCKFILE
+        """
+        if not self.test_impact or len(self.test_versions) < 2:
+            return {}
+        setup = (self.directory / SETUPTOOLS).read_json(leaves=False)
+        packages = listwrap(setup.packages) or [self.package_name.replace("-", "_")]
+        with Timer("find tests impacted by changes in {{module}}", param={"module": self.name}):
+            impacted = ImportGraph(self.directory, packages).impacted_tests(self.get_changed_files())
+        if impacted is None:
+            logger.info("{{module}} runs all tests on all python versions", module=self.name)
+            return {}
+        lowest = str(min(Version(v) for v in self.test_versions))
+        logger.info(
+            "{{module}} runs all tests on python {{lowest}}, and {{num}} impacted test modules on others: {{tests}}",
+            module=self.name,
+            lowest=lowest,
+            num=len(impacted),
+            tests=impacted,
+        )
+        return {v: impacted for v in self.test_versions if v != lowest}
+
+    def run_tests(self, python_version, please_stop, test_modules=None):
+        """
+        :param test_modules: LIST OF TEST MODULES TO RUN, None FOR ALL
+        """
+        with tracer.phase(f"test {python_version}", module=self.name):
+            self._run_tests(python_version, test_modules)
+
+    def _run_tests(self, python_version, test_modules):
         # if python_version == "3.12":
         #     return  # python 3.12 is unstable
 
         # SETUP NEW ENVIRONMENT
         with TempDirectory() as temp:
-            # python -m pip install virtualenv  # venv is buggy on Windows
-            # REM IMPORTANT: Notice the dot in `.venv`
-            # python -m virtualenv .venv
-            # .venv\Scripts\activate
-            # pip install -r requirements\dev.txt
-            # pip install -r requirements\common.txt
-            python = temp / ".venv" / "Scripts" / "python.exe"
-            pip = temp / ".venv" / "Scripts" / "pip.exe"
+            # COPY OF A POOLED, BARE, virtualenv
+            # USE `python -m pip`; THE pip.exe IN THE COPY STILL POINTS TO THE POOLED ENVIRONMENT
+            logger.info("clone virtualenv into {{dir}}", dir=temp.abs_path)
+            python = venv_python(self.graph.venv_pool.bare(self, python_version, temp / "smoke"))
             test_reqs = None
 
-            logger.info("install virtualenv into {{dir}}", dir=temp.abs_path)
-            self.local([
-                self.python[python_version],
-                "-m",
-                "pip",
-                "install",
-                "virtualenv",
-            ])
-            self.local(
-                [self.python[python_version], "-m", "virtualenv", temp / ".venv"], cwd=temp,
-            )
-            self.local([python, "-m", "pip", "install", "--upgrade", "pip", "setuptools"], cwd=self.directory)
-
-            # CLEAN INSTALL FIRST, TO TEST FOR VERSION COMPATIBILITY
-            self.gen_setup_py_file()
-            self.install_self(pip)
+            # INSTALL FIRST, TO TEST FOR VERSION COMPATIBILITY
+            self.install_self(python)
 
             # RUN THE SMOKE TEST
             logger.info("run tests/smoke_test.py")
@@ -458,67 +561,88 @@ class Module(object):
             else:
                 logger.warning("add tests/smoke_test.py to ensure the library will run after installed")
 
-            # INSTALL TEST RESOURCES
+            # COPY OF A POOLED virtualenv, WITH THE TEST REQUIREMENTS ALREADY INSTALLED
+            logger.info("clone test virtualenv into {{dir}}", dir=temp.abs_path)
+            python = venv_python(self.graph.venv_pool.prepared(self, python_version, temp))
+
+            # INSTALL TEST RESOURCES (ONLY WHAT IS NEWER THAN THE POOLED ENVIRONMENT)
             logger.info("install testing requirements")
             if (self.directory / "tests" / "requirements.txt").exists:
-                # TRY THE lock FILE, FOR QUICKER INSTALL.  NOT NEEDED
-                self.local([pip, "install", "--no-deps", "-r", "tests/requirements.lock"], raise_on_error=False)
-
                 while True:
-                    try:
-                        self.local(
-                            [
-                                # pip,
-                                python,
-                                "-m",
-                                "pip",
-                                "install",
-                                "--upgrade",
-                                "-r",
-                                "tests/requirements.txt",
-                            ],
-                            debug=True,
-                        )
-                        _, test_reqs, _ = self.local([pip, "freeze"], env={"PYTHONPATH": "."})
+                    p, stdout, stderr = self.graph.wheelhouse.pip_install(
+                        self, python, ["-r", "tests/requirements.txt"], upgrade=True, debug=True, watch=INSTALL_PROBLEMS
+                    )
+                    if not p.returncode:
+                        _, test_reqs, _ = self.local([python, "-m", "pip", "freeze"], env={"PYTHONPATH": "."})
                         break
-                    except Exception as cause:
-                        if any(
-                            'pip\\_vendor\\packaging\\version.py", line 264, in __init__' in e
-                            for e in cause.cause.params.stderr
-                        ):
-                            # Happens occasionally, so retry
-                            logger.warning("Problem with install", cause=cause.cause.params.stderr)
-                        else:
-                            raise cause
+                    if stderr.found("pip version"):
+                        # Happens occasionally, so retry
+                        logger.warning("Problem with install", cause=stderr)
+                    else:
+                        logger.error("Can not install test requirements {{stderr}}", stderr=stderr)
 
             # INSTALL SELF AGAIN TO ENSURE CORRECT VERSIONS ARE USED (EVEN IF CONFLICT WITH TEST RESOURCES)
-            self.install_self(pip)
+            self.install_self(python)
 
             # RUN THE TESTS
+            if test_modules == []:
+                logger.info("No tests impacted by the changes, so no tests run on python {{version}}", version=python_version)
+                return
             with Timer("run tests"):
-                process, stdout, stderr = self.local(
-                    [python, "-m", "unittest", "discover", "tests", "-v"], env={"PYTHONPATH": "."}, debug=True,
+                report = self.run_test_runner(python, python_version, temp, modules=test_modules)
+                logger.info(
+                    "{{module}} ran {{total}} tests on python {{version}} in {{duration|round(places=1)}} seconds",
+                    module=self.name,
+                    total=report.summary.total,
+                    version=python_version,
+                    duration=report.summary.duration,
                 )
-                logger.info("TESTS DONE")
-                if len(stderr) < 2:
-                    logger.error("Expecting unittest results (at least two lines of output)")
-                summary = first(line for line in reversed(stderr) if line.startswith("Ran "))
-                num_tests = int(strings.between(summary, "Ran ", " test"))
-                if num_tests == 0:
-                    logger.error("Expecting to run some tests: {{error}}", error=stderr[-2])
-                summary_index = stderr.index(summary)
-
-                if not stderr[summary_index + 1].startswith("OK"):
-                    logger.error("Expecting all tests to pass: {{error}}", error=last(stderr))
-                logger.info("STDERR:\n{{stderr|indent}}", stderr=stderr)
+                if report.summary.total == 0:
+                    logger.error("Expecting to run some tests")
+                if not report.summary.passed:
+                    problems = [t for t in report.tests if t.status in BAD_TEST_STATUS]
+                    logger.error(
+                        "Expecting all tests to pass: {{problems|json}}",
+                        problems=[{"id": t.id, "status": t.status, "message": t.message} for t in problems],
+                    )
 
             # WRITE lock FILE TO RECORD THE SUCCESSFUL COMBINATION
             if test_reqs:
-                self.write_lock_file(python, pip, python_version, test_reqs)
+                self.write_lock_file(python, python_version, test_reqs)
 
         logger.info("done")
 
-    def write_lock_file(self, python, pip, python_version, test_reqs):
+    def run_test_runner(self, python, python_version, temp, modules=None):
+        """
+        RUN THE TEST MODULES ACROSS WORKER PROCESSES IN THE GIVEN virtualenv
+        :param modules: OPTIONAL LIST OF TEST MODULES TO RUN (DEFAULT ALL)
+        :return: THE JSON REPORT
+        """
+        report_file = temp / "test_report.json"
+        timings_file = File(self.state_directory) / "timings" / self.name / f"{python_version}.json"
+        workers = coalesce(self.test_workers, max(1, (os.cpu_count() or 1) // max(1, len(self.test_versions))))
+        self.local(
+            [
+                python,
+                TEST_RUNNER,
+                "tests",
+                "--workers",
+                str(workers),
+                "--timings",
+                timings_file,
+                "--report",
+                report_file,
+                *(["--modules", *modules] if modules is not None else []),
+            ],
+            env={"PYTHONPATH": "."},
+            raise_on_error=False,
+            debug=True,
+        )
+        if not report_file.exists:
+            logger.error("Expecting test report {{file}}", file=report_file.abs_path)
+        return json2value(report_file.read())
+
+    def write_lock_file(self, python, python_version, test_reqs):
         # ONLY THE LOWEST VERSION WILL WRITE THE LOCKFILE
         if python_version != str(min(*(Version(v) for v in self.test_versions))):
             return
@@ -543,7 +667,7 @@ class Module(object):
                         line = str(r)
                 new_test_reqs.append(line)
 
-            process, stdout, stderr = self.local([pip, "freeze"], env={"PYTHONPATH": "."})
+            process, stdout, stderr = self.local([python, "-m", "pip", "freeze"], env={"PYTHONPATH": "."})
             lock_reqs = [
                 line
                 for line in stdout
@@ -564,42 +688,78 @@ class Module(object):
         except Exception as cause:
             logger.error("Can not write lockfile", cause=cause)
 
-    def install_self(self, pip):
+    def install_self(self, python):
+        # NO LOCK: THE wheel IS ALREADY BUILT, SO ALL TEST ENVIRONMENTS MAY INSTALL AT ONCE
+        # THE wheel IS NOT TESTED YET, SO ONLY ITS REQUIREMENTS GO INTO THE WHEELHOUSE
+        requirements = listwrap((self.directory / SETUPTOOLS).read_json(leaves=False).install_requires)
         while True:
-            try:
-                with Timer("install self", verbose=True):
-                    with self.install_locker:
-                        logger.info("got lock")
-                        p, stdout, stderr = self.local([pip, "install", "."], debug=True)
-                if p.returncode and any("which is incompatible" in line for line in stderr):
-                    logger.error("Seems we have an incompatibility problem", stderr=stderr)
-                if p.returncode and any("conflicting dependencies" in line for line in stderr):
-                    logger.error("Seems we have a conflicting dependencies problem", stderr=stderr)
+            with Timer("install self", verbose=True):
+                p, stdout, stderr = self.graph.wheelhouse.pip_install(
+                    self, python, [self.wheel.os_path], debug=True, watch=INSTALL_PROBLEMS, fill=list(requirements)
+                )
+            if not p.returncode:
                 break
-            except Exception as cause:
-                if any("unable to write new index file" in e for e in cause.cause.params.stderr):
-                    # Happens occasionally, so retry
-                    logger.warning("Problem with install", cause=cause.cause.params.stderr)
-                elif any("because the GET request got Content-Type" in e for e in cause.cause.params.stderr):
-                    # Happens occasionally, so retry
-                    logger.warning("Problem with install", cause=cause.cause.params.stderr)
-                elif any("Directory '.' is not installable. " in e for e in cause.cause.params.stderr):
-                    # Happens occasionally, so retry
-                    (self.directory / "setup.py").write((self.directory / "packaging" / "setup.py").read())
-                    logger.warning("Problem with install", cause=cause.cause.params.stderr)
-                else:
-                    logger.error("Problem with install", cause=cause)
-
-    def local(self, args, raise_on_error=True, show_all=False, cwd=None, env=None, debug=False):
+            if stderr.found("incompatible"):
+                logger.error("Seems we have an incompatibility problem", stderr=stderr)
+            if stderr.found("conflicting"):
+                logger.error("Seems we have a conflicting dependencies problem", stderr=stderr)
+
+            if stderr.found("index file"):
+                # Happens occasionally, so retry
+                logger.warning("Problem with install", cause=stderr)
+            elif stderr.found("content type"):
+                # Happens occasionally, so retry
+                logger.warning("Problem with install", cause=stderr)
+            else:
+                logger.error("Problem with install {{stderr}}", stderr=stderr)
+
+    def local(
+        self, args, raise_on_error=True, show_all=False, cwd=None, env=None, debug=False, resource=None, watch=None
+    ):
+        """
+        :param resource: RESOURCE CLASS OF THE COMMAND (SEE mo_threads.governor), DEFAULT IS resource_class(args)
+        :param watch: MAP FROM NAME TO PATTERN TO FIND IN THE OUTPUT AS IT ARRIVES (SEE Capture.found)
+        :return: (Command, stdout, stderr) WHERE stdout AND stderr ARE Capture, SO BIG OUTPUT IS NOT ALL IN MEMORY
+        """
         try:
             cwd = coalesce(cwd, self.directory)
             env = coalesce(env, {"PYTHONPATH": "."})
-            p = Command(
-                self.name, args, cwd=cwd, env=env, max_stdout=10 ** 6, debug=debug, timeout=120
-            ).join(raise_on_error=raise_on_error)
-            stdout = list(p.stdout)
-            stderr = list(p.stderr)
-            p.join()
+            if resource is None:
+                resource = resource_class(args)
+            if resource is None:
+                slot = governor.acquire(None)
+            else:
+                # WAITING FOR A SLOT IS NOT PART OF THE COMMAND'S TIME
+                with tracer.span(f"wait for {resource}", WAIT, resource=resource):
+                    slot = governor.acquire(resource, self.priority)
+            moves = moves_refs(args)
+            try:
+                if moves:
+                    refs_signatures.moved(self.directory.abs_path)
+                with tracer.span(
+                    step_name(args), COMMAND, module=self.name, argv=[str(a) for a in args], cwd=str(cwd)
+                ) as span:
+                    stdout = Capture(f"stdout of {self.name}", watch=watch)
+                    stderr = Capture(f"stderr of {self.name}", watch=watch)
+                    p = Command(
+                        self.name,
+                        args,
+                        cwd=cwd,
+                        env=env,
+                        debug=debug,
+                        timeout=120,
+                        slot=slot,
+                        stdout=stdout,
+                        stderr=stderr,
+                    ).join(raise_on_error=raise_on_error)
+                    span.args["exit"] = p.returncode
+            except Exception as cause:
+                slot.release()  # DOES NOTHING IF THE Command RELEASED IT
+                raise cause
+            finally:
+                if moves:
+                    # AGAIN, IN CASE THE SIGNATURE WAS TAKEN WHILE THE COMMAND RAN
+                    refs_signatures.moved(self.directory.abs_path)
             if show_all:
                 logger.info(
                     "{{module}} stdout = {{stdout}}\nstderr = {{stderr}}",
@@ -647,45 +807,73 @@ class Module(object):
         return self.get_setup_version().major
 
     @cache()
+    @stored(decode=Version)
     def get_setup_version(self):
-        try:
-            # read version from git
-            p, stdout, stderr = self.local([self.git, "show", f"{self.dev_branch}:{SETUPTOOLS}"], raise_on_error=True,)
-            setup = json2value("\n".join(stdout), leaves=False)
-        except Exception:
+        # read version from git
+        setup = self.git_reader.read_json(self.dev_branch, SETUPTOOLS)
+        if setup is None:
             setup_json = self.directory / SETUPTOOLS
             setup = setup_json.read_json(leaves=False)
         return Version(setup.version, prefix="v")
 
     def clean_branches(self):
+        if self.graph.dry_run:
+            return
         p, stdout, stderr = self.local([self.git, "branch", "-a"])
         for branch in stdout:
             branch = branch.strip()
             if branch.startswith(TEMP_BRANCH_PREFIX):
                 self.local([self.git, "branch", "-D", branch], raise_on_error=False)
 
+    @property
+    def git_reader(self):
+        return git_reader.get_reader(self.git, self.directory)
+
+    def refs_signature(self):
+        """
+        RETURN HASH OF ALL BRANCH AND TAG SHAs; CHANGES WHEN ANY REF MOVES
+        """
+
+        def compute():
+            p, stdout, stderr = self.local([self.git, "show-ref", "--head"], raise_on_error=False)
+            return hashlib.sha1("\n".join(stdout).encode("utf8")).hexdigest()
+
+        return refs_signatures.get(self.directory.abs_path, compute)
+
     @cache()
-    def get_version(self):
-        # RETURN version, revision PAIR
+    @stored(encode=lambda vs: [str(v) for v in vs], decode=lambda vs: [Version(v) for v in vs])
+    def get_all_versions(self):
         p, stdout, stderr = self.local([self.git, "tag"])
         # ONLY PICK VERSIONS WITH vX.Y.Z PATTERN
-        all_versions = self.all_versions = list(sorted(
-            v for line in stdout for v in [Version(line)] if v.major == self.get_major_version()
-        ))
+        return list(sorted(v for line in stdout for v in [Version(line)] if v.major == self.get_major_version()))
+
+    @property
+    def all_versions(self):
+        return self.get_all_versions()
 
+    @cache()
+    @stored(
+        encode=lambda vr: vr and [str(vr[0]), vr[1]], decode=lambda vr: vr and (Version(vr[0]), vr[1]),
+    )
+    def get_tagged_version(self):
+        # RETURN version, revision PAIR OF THE LATEST TAG, OR None
+        all_versions = self.all_versions
         if all_versions:
             version = max(all_versions)
             logger.info("Found {version} of {module} in git tags", version=version, module=self.name)
-            try:
-                p, stdout, stderr = self.local([self.git, "show", text(version)])
-            except Exception:
-                # HAPPENS WHEN NO VERSIONS ON NEW MODULE EXIST
-                stdout = []
-            for line in stdout:
-                if line.startswith("commit "):
-                    revision = line.split("commit")[1].strip()
-                    return version, revision
+            revision = self.git_reader.commit_of(text(version))
+            if revision:
+                return version, revision
+        return None
 
+    @cache()
+    def get_version(self):
+        # RETURN version, revision PAIR
+        tagged = self.get_tagged_version()
+        if tagged:
+            return tagged
+
+        # NOT STORED: last_deploy() IS STORED FOR LESS TIME THAN THE REFS LAST
         version = self.last_deploy()
         if version is NO_VERSION:
             version = FIRST_VERSION
@@ -697,14 +885,18 @@ class Module(object):
         return self.get_version()[0]
 
     @cache(lock=True)
+    @stored(
+        encode=lambda deps: [{"name": d["name"], "version": d["version"] and str(d["version"])} for d in deps],
+        decode=lambda deps: [{"name": d["name"], "version": d["version"] and Version(d["version"])} for d in deps],
+    )
     def get_old_dependencies(self, version):
         # RETURN LIST OF {"name", "version"} dicts
         logger.info("Find {{name}}=={{version}} in git history", name=self.package_name, version=version)
-        p, stdout, stderr = self.local([self.git, "show", f"{version}:{SETUPTOOLS}"], raise_on_error=False)
-        if p.returncode or any("invalid object name" in line for line in stderr):
+        setup = self.git_reader.read_json(version, SETUPTOOLS)
+        if setup is None:
             requirements = File(self.directory / SETUPTOOLS).read_json().install_requires
         else:
-            requirements = json2value("\n".join(stdout)).install_requires
+            requirements = setup.install_requires
 
         def deps():
             for r in requirements:
@@ -733,6 +925,10 @@ class Module(object):
                 revision = line.split("commit")[1].strip()
                 return revision
 
+    def dev_revision(self):
+        p, stdout, stderr = self.local([self.git, "rev-parse", self.dev_branch])
+        return stdout[0].strip()
+
     def current_revision(self):
         p, stdout, stderr = self.local([self.git, "log", "-1"])
         for line in stdout:
@@ -742,6 +938,16 @@ class Module(object):
 
     @cache()
     def please_upgrade(self):
+        if self.graph.dry_run:
+            return self.has_changes()
+        self.svn_update()
+        self.update_dev("updates from other projects")
+        return self.has_changes()
+
+    def has_changes(self):
+        """
+        RETURN True IF dev HAS CHANGES THAT ARE NOT RELEASED
+        """
         ignored_files = [
             "setup.py",
             "setuptools.json",
@@ -752,72 +958,83 @@ class Module(object):
         ]  # , ".travis.yml"]
         ignored_dir = ["packaging/", "tests/", "vendor/", ".github/"]
 
-        # get current version, hash
-        version, revision = self.get_version()
-        self.svn_update()
-        self.update_dev("updates from other projects")
-        # COMPARE TO MASTER
-        branch_name = f"{TEMP_BRANCH_PREFIX}{randoms.string(10)}"
-        while True:
-            try:
-                self.local([self.git, "checkout", "-b", branch_name, self.master_branch])
-                break
-            except Exception as cause:
-                if "unable to write new index file" in cause:
-                    logger.warning("retrying checkout", cause=cause)
-                    continue
-                raise cause
-        try:
-            self.local([self.git, "merge", self.dev_branch])
-            p, stdout, stderr = self.local([self.git, "--no-pager", "diff", "--name-only", "master"], debug=True,)
-            changed_files = [
-                clean_line
-                for line in stdout
-                for clean_line in [line.strip()]
-                if clean_line
-                and clean_line not in ignored_files
-                and not any(clean_line.startswith(d) for d in ignored_dir)
-            ]
-            if len(changed_files) > 4:
-                logger.info("Upgrade {module} because {num} files changed", module=self.name, num=len(changed_files))
-                curr_revision = self.current_revision()
-            elif changed_files:
-                logger.info(
-                    "Upgrade {module} because {num} files changed {files}",
-                    module=self.name,
-                    num=len(changed_files),
-                    files=changed_files,
-                )
-                curr_revision = self.current_revision()
-            else:
-                curr_revision = revision
-
-            while True:
-                try:
-                    self.local([self.git, "checkout", "-f", self.dev_branch])
-                    break
-                except Exception as cause:
-                    if any(r in cause for r in ["unable to write symref", "unable to write new index file"]):
-                        logger.warning("retrying checkout", cause=cause)
-                        continue
-                    raise
-        except Exception as e:
-            logger.warning("problem determining upgrade status", cause=e)
-            self.local([self.git, "reset", "--hard", "HEAD"])
-            self.local([self.git, "checkout", "-f", self.dev_branch])
-            curr_revision = self.current_revision()
-        finally:
-            try:
-                self.local([self.git, "branch", "-D", branch_name], raise_on_error=True)
-            except Exception:
-                logger.info("can not delete branch {branch}", branch=branch_name)
+        changed_files = [
+            f for f in self.get_changed_files() if f not in ignored_files and not any(f.startswith(d) for d in ignored_dir)
+        ]
+        if len(changed_files) > 4:
+            logger.info("Upgrade {module} because {num} files changed", module=self.name, num=len(changed_files))
+        elif changed_files:
+            logger.info(
+                "Upgrade {module} because {num} files changed {files}",
+                module=self.name,
+                num=len(changed_files),
+                files=changed_files,
+            )
+        return bool(changed_files)
 
-        return curr_revision != revision
+    @cache(lock=True)
+    @stored(encode=list, decode=list)
+    def get_changed_files(self):
+        """
+        RETURN ALL FILES master WOULD SEE CHANGE IF dev WAS MERGED INTO IT
+        ONLY PLUMBING COMMANDS ARE USED, SO THE WORKING TREE AND INDEX ARE NOT TOUCHED
+        """
+        # merge-tree WRITES THE MERGED TREE TO THE OBJECT STORE, AND RETURNS ITS HASH (git >= 2.38)
+        # returncode==1 IS A CONFLICT, BUT THE TREE (WITH CONFLICT MARKERS) IS STILL GOOD FOR COMPARISON
+        p, stdout, stderr = self.local(
+            [self.git, "merge-tree", "--write-tree", "--no-messages", self.master_branch, self.dev_branch],
+            raise_on_error=False,
+        )
+        if p.returncode in (0, 1) and stdout:
+            merged_tree = stdout[0].strip()
+            p, stdout, stderr = self.local([self.git, "diff-tree", "-r", "--name-only", self.master_branch, merged_tree])
+        else:
+            # OLDER git: WHAT CHANGED ON dev SINCE THE MERGE BASE WITH master
+            p, stdout, stderr = self.local(
+                [self.git, "diff", "--name-only", f"{self.master_branch}...{self.dev_branch}"]
+            )
+        return [clean_line for line in stdout for clean_line in [line.strip()] if clean_line]
 
     def __str__(self):
         return self.name
 
 
+def step_name(args):
+    """
+    SHORT NAME OF A COMMAND, LIKE "git checkout" OR "python -m pip"
+    """
+    words = [os.path.splitext(os.path.basename(str(args[0])))[0]] + [str(a) for a in args[1:3]]
+    if len(words) > 1 and words[1] != "-m":
+        words = words[:2]
+    return " ".join(words)
+
+
+def resource_class(args):
+    """
+    WHAT A COMMAND MOSTLY WAITS ON; None FOR SHORT, LOCAL COMMANDS THAT ARE NOT WORTH LIMITING
+    """
+    words = [os.path.splitext(os.path.basename(str(a)))[0] for a in args[:1]] + [str(a) for a in args[1:]]
+    program, rest = words[0], words[1:]
+    if program == "git":
+        return NETWORK if rest[:1] in (["push"], ["fetch"], ["pull"], ["clone"], ["ls-remote"]) else None
+    if program == "svn":
+        return NETWORK if rest[:1] in (["update"], ["commit"], ["checkout"]) else None
+    if program == "twine":
+        return NETWORK
+    if rest[:1] == ["-m"]:
+        tool = rest[1:3]
+        if tool[:1] == ["pip"]:
+            if tool[1:] in (["install"], ["wheel"], ["download"]):
+                return IO_HEAVY if "--no-index" in rest else NETWORK
+            return None
+        if tool[:1] in (["virtualenv"], ["venv"]):
+            return IO_HEAVY
+        return CPU_HEAVY  # build, unittest
+    if any(w.endswith(".py") for w in rest[:2]):
+        return CPU_HEAVY  # TESTS
+    return None
+
+
 def count(values):
     return sum(1 if exists(v) else 0 for v in values)
 
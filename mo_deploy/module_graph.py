@@ -6,38 +6,69 @@
 #
 # Author: Kyle Lahnakoski (kyle@lahnakoski.com)
 #
-from copy import copy
-
 from toposort import toposort
 
-import mo_math
+from mo_deploy.dependency_index import DependencyIndex
 from mo_deploy.deploy_module import DeployModule
 from mo_deploy.module import Module
+from mo_deploy.package_index import PackageIndex
+from mo_deploy.publish_waiter import PublishWaiter
+from mo_deploy.push_queue import PushQueue
+from mo_deploy.trace import tracer
+from mo_deploy.venv_pool import VenvPool
+from mo_deploy.version_resolver import VersionResolver
+from mo_deploy.wheelhouse import Wheelhouse
 from mo_deploy.utils import Requirement, TODAY
 from mo_dots import listwrap
-from mo_http import http
+from mo_files import File
 from mo_logs import logger, logger
-from mo_logs.exceptions import Except
-from mo_math import UNION
 from mo_threads import Lock, Thread, join_all_threads
+from mo_threads.commands import prewarm
 from mo_times import Timer
 from pyLibrary.utils import Version
 
 
 class ModuleGraph(object):
-    def __init__(self, module_directories, deploy, latest_python_version):
+    def __init__(self, module_directories, deploy, latest_python_version, dry_run=False):
+        """
+        :param dry_run: True TO LOOK AT THE REPOSITORIES WITHOUT CHANGING THEM (NO svn SYNC, NO MERGE, NO PUSH)
+        """
         graph = self.graph = {}
+        self.dry_run = dry_run
         curr_versions = self.curr_versions = {}
         self.latest_python_version = latest_python_version
+        self.index = PackageIndex(Module.index_url, File(Module.state_directory) / "index")
+        self.publish_waiter = PublishWaiter(self.index)
+        if dry_run:
+            # NOTHING IS BUILT OR TESTED, AND Wheelhouse WOULD DELETE THE LAST RUN'S WHEELS
+            self.venv_pool = None
+            self.wheelhouse = None
+        else:
+            self.venv_pool = VenvPool(File(Module.state_directory) / "venvs", Module.venv_pool_bytes)
+            self.wheelhouse = Wheelhouse(File(Module.state_directory) / "wheelhouse")
+        self.push_queue = PushQueue()
 
         self.modules = {
             m.name: m for d in module_directories for m in [Module(d, self)]
         }
+        unknown = [d for d in listwrap(deploy) if d not in self.modules]
+        if unknown:
+            logger.warning("Not deploying {names}, they are not managed modules", names=unknown)
+        deploy = [d for d in listwrap(deploy) if d in self.modules]
         self.modules["__deploy__"] = DeployModule(self, deploy)
+        # START A SHELL IN EVERY REPOSITORY AT ONCE; env MUST MATCH Module.local()
+        with Timer("start shells"):
+            prewarm(
+                [m.directory for m in self.modules.values() if isinstance(m, Module)], env={"PYTHONPATH": "."}
+            )
 
         graph_lock = Lock()
 
         def info(m, please_stop):
+            with tracer.phase("requirements", module=m.name):
+                _info(m)
+
+        def _info(m):
             module_name = m.name
             m.clean_branches()
             # FIND DEPENDENCIES FOR EACH MODULE
@@ -56,23 +87,21 @@ class ModuleGraph(object):
         join_all_threads([Thread.run(m.name, info, m) for m in self.modules.values()])
 
         self.toposort = list(toposort(graph))
+        self.dependencies = DependencyIndex(graph)
 
-        def closure(parents):
-            prev = set()
-            dependencies = set(listwrap(parents))
-            while dependencies - prev:
-                prev = copy(dependencies)
-                for d in list(dependencies):
-                    dependencies |= graph.get(d, set())
-            return dependencies
+        # FETCH RELEASES OF ALL MANAGED AND THIRD-PARTY PACKAGES AT ONCE
+        self.index.prefetch(
+            [m.package_name for m in self.modules.values() if isinstance(m, Module)]
+            + [r for reqs in graph.values() for r in reqs if r not in self.modules]
+        )
 
         # CALCULATE ALL DEPENDENCIES FOR EACH
         for m in list(graph.keys()):
-            graph[m] = closure(m)
+            graph[m] = set(self.dependencies.requirements(m))
 
         # WHAT MUST BE DEPLOYED?
         deploy_dependencies = list(sorted(
-            set(self.modules[d] for d in closure(deploy) if d in self.modules),
+            set(self.modules[d] for d in self.dependencies.requirements(deploy) if d in self.modules),
             key=lambda m: m.name
         ))
 
@@ -82,8 +111,9 @@ class ModuleGraph(object):
         )
         # PREFETCH SOME MODULE STATUS
         def pre_fetch_state(d, please_stop):
-            d.please_upgrade()
-            d.last_deploy()
+            with tracer.phase("changes", module=d.name):
+                d.please_upgrade()
+                d.last_deploy()
 
         with Timer("get modules' status"):
             join_all_threads(
@@ -94,6 +124,10 @@ class ModuleGraph(object):
             # for d in deploy_dependencies:
             #     pre_fetch_state(d, None)
 
+        # dev BRANCHES UPDATED FROM svn
+        with tracer.phase("push"):
+            self.push_queue.flush()
+
         # DO ANY ON THE deploy REQUIRE UPGRADE?
         summary = [
             (m.name, m.please_upgrade(), m.last_deploy(), m.get_version()[0])
@@ -133,80 +167,10 @@ class ModuleGraph(object):
 
         is_upgrading = set(self._next_version.keys())
 
-        def scan(module: Module, version: Version, new_version: Version, ancestor_upgrading, depth=0):
-            """
-            LOG THE module:version FOR EVERYTHING IN THE DEPENDENCIES
-            Markup modules that need incidental upgrade
-            * modules between two upgrades
-            * modules version conflict must upgrade (added to self._next_version)
-
-            return if child is upgrading
-            """
-            reqs = module.get_old_dependencies(version)
-            any_decendant_upgrading = False
-
-            for req in reqs:
-                req_name, req_version = req["name"], req["version"]
-                # logger.info(
-                #     "{{module}}=={{version}} requires {{req_name}}=={{req_version}}",
-                #     module=module.name,
-                #     version=version,
-                #     req_name=req_name,
-                #     req_version=req_version,
-                # )
-                managed_req = self.modules.get(req_name)
-                if not req_version:
-                    curr_version = self.curr_versions.setdefault(req_name, self.get_pypi_version(req_name))
-                    req_version = curr_version
-                else:
-                    curr_version = self.curr_versions.setdefault(req_name, req_version)
-
-                req_new_version = Version((
-                    mo_math.max(curr_version.major, managed_req.get_version()[0].major if managed_req else None),
-                    self.next_minor_version,
-                    TODAY,
-                ))
-
-                if module.name not in is_upgrading:
-                    if curr_version < req_version:
-                        is_upgrading.add(module.name)
-                        self._next_version[req_name] = req_new_version
-                        logger.error("not done")
-                    elif req_version < curr_version:
-                        # THERE IS A CONFLICT SOMEWHERE IN THE DEPENDENCY TREE
-                        is_upgrading.add(module.name)
-                        self._next_version[module.name] = Version((
-                            module.version.major,
-                            self.next_minor_version,
-                            TODAY,
-                        ))
-                        logger.error("not done")
-
-                if managed_req:
-                    if depth > 100:
-                        logger.error("not done")
-                    descendant_upgrading = scan(managed_req, curr_version, req_new_version, ancestor_upgrading or module.name in is_upgrading, depth=depth+ 1)
-                    any_decendant_upgrading |= descendant_upgrading
-                    if module.name not in is_upgrading and descendant_upgrading and ancestor_upgrading:
-                        is_upgrading.add(module.name)
-                        if new_version is None:
-                            logger.error("do not know how to handle")
-                        self._next_version[module.name] = new_version
-                        logger.error("not done")
-
-            return any_decendant_upgrading or module.name in is_upgrading
-
-        while True:
-            try:
-                for t in self.todo:
-                    scan(t, self._next_version[t.name], None, True)
-            except Exception as cause:
-                cause = Except.wrap(cause)
-                if "not done" in cause:
-                    continue
-                logger.error("problem while scanning past versions", cause=cause)
-            else:
-                break
+        with tracer.phase("resolve versions"):
+            VersionResolver(
+                self.modules, self.curr_versions, self.next_minor_version, TODAY, self.get_pypi_version
+            ).resolve(self.todo, self._next_version, is_upgrading)
 
         logger.info(
             "Using old versions {{versions}}",
@@ -229,8 +193,10 @@ class ModuleGraph(object):
             logger.alert("Updating: {{modules}}", modules=[(m.name, self._next_version[m.name]) for m in self.todo])
 
     def get_pypi_version(self, module_name):
-        result = http.get_json(f"https://pypi.org/pypi/{module_name}/json")
-        return max(Version(v) for v in result.releases.keys())
+        version = self.index.latest(module_name)
+        if version is None:
+            logger.error("No {{module}} versions found on {{url}}", module=module_name, url=self.index.url)
+        return version
 
     def get_next_version(self, module_name):
         return self._next_version[module_name]
@@ -242,33 +208,13 @@ class ModuleGraph(object):
         """
         RETURN THE MODULES THAT DEPEND ON THIS
         """
-        dependencies = set(m.name for m in modules)
-        num = 0
-        # FIND FIXPOINT
-        while num < len(dependencies):
-            num = len(dependencies)
-            dependencies = UNION(
-                [dependencies]
-                + [
-                    set(m for r in reqs if r in dependencies)
-                    for m, reqs in self.graph.items()
-                ]
-            )
-
-        return self._sorted(dependencies)
+        return self._sorted(set(self.dependencies.dependents([m.name for m in modules])))
 
     def get_requirements(self, modules):
         """
         RETURN THE MODULES THAT THIS DEPENDS ON
         """
-        requirements = set(m.name for m in modules)
-        num = 0
-        # FIND FIXPOINT
-        while num < len(requirements):
-            num = len(requirements)
-            requirements = UNION(self.graph[d] for d in requirements)
-
-        return self._sorted(requirements)
+        return self._sorted(set(self.dependencies.requirements([m.name for m in modules])))
 
     def _sorted(self, candidates):
         """
@@ -0,0 +1,141 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from requests import sessions
+from requests.adapters import HTTPAdapter
+
+from mo_deploy.trace import tracer, HTTP
+from mo_files import File, URL
+from mo_http import http
+from mo_json import json2value, value2json
+from mo_logs import logger
+from mo_threads import Lock, Thread, join_all_threads
+from mo_times import Timer
+from pyLibrary.utils import Version
+
+DEBUG = False
+PYPI = "https://pypi.org/pypi"
+MAX_CONNECTIONS = 10
+
+
+class PackageIndex(object):
+    """
+    RELEASE LISTS FROM A PYPI-LIKE JSON API (<url>/<name>/json)
+
+    url MAY BE file://<directory>, WITH THE SAME <name>/json LAYOUT, SO A LOCAL
+    DIRECTORY (OR `python -m http.server` OVER ONE) CAN STAND IN FOR PYPI
+    """
+
+    def __init__(self, url=PYPI, cache_directory=None, max_connections=MAX_CONNECTIONS):
+        self.url = str(url or PYPI).rstrip("/")
+        self.cache = File(cache_directory) if cache_directory else None
+        self.max_connections = max_connections
+        self.session = sessions.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.locker = Lock("package index")
+        self.releases = {}  # MAP FROM PACKAGE NAME TO LIST OF RELEASE VERSIONS (AS STRINGS)
+
+    def get_releases(self, name, refresh=False):
+        """
+        :param name: PACKAGE NAME
+        :param refresh: IGNORE WHAT WAS FETCHED ALREADY DURING THIS RUN
+        :return: LIST OF RELEASE VERSIONS (AS STRINGS), EMPTY IF THE PACKAGE IS NOT KNOWN
+        """
+        if not refresh:
+            with self.locker:
+                releases = self.releases.get(name)
+            if releases is not None:
+                return releases
+
+        with tracer.span(f"index {name}", HTTP, url=f"{self.url}/{name}/json", refresh=refresh) as span:
+            if self.url.startswith("file://"):
+                releases = self._get_file_releases(name)
+            else:
+                releases = self._get_http_releases(name, span)
+            span.args["releases"] = len(releases)
+        with self.locker:
+            self.releases[name] = releases
+        return releases
+
+    def get_versions(self, name, refresh=False):
+        return [Version(k, prefix="v") for k in self.get_releases(name, refresh=refresh)]
+
+    def latest(self, name, major=None):
+        """
+        :return: HIGHEST VERSION (WITH GIVEN major), None IF NOTHING IS RELEASED
+        """
+        candidates = [v for v in self.get_versions(name) if major is None or v.major == major]
+        if not candidates:
+            return None
+        return max(candidates)
+
+    def prefetch(self, names):
+        """
+        FETCH MANY PACKAGES CONCURRENTLY, USING THE POOLED CONNECTIONS
+        """
+        todo = list(sorted(set(names)))
+        todo_locker = Lock("prefetch todo")
+
+        def worker(please_stop):
+            while not please_stop:
+                with todo_locker:
+                    if not todo:
+                        return
+                    name = todo.pop()
+                try:
+                    self.get_releases(name)
+                except Exception as cause:
+                    logger.warning("Can not get releases for {name}", name=name, cause=cause)
+
+        with Timer("prefetch {num} packages from {url}", param={"num": len(todo), "url": self.url}):
+            join_all_threads(
+                Thread.run(f"index worker {i}", worker) for i in range(min(self.max_connections, len(todo)))
+            )
+
+    def _get_file_releases(self, name):
+        file = File(self.url[len("file://") :]) / name / "json"
+        if not file.exists:
+            return []
+        return list(json2value(file.read()).releases.keys())
+
+    def _get_http_releases(self, name, span):
+        url = URL(self.url) / name / "json"
+        cache_file = self.cache / (name + ".json") if self.cache is not None else None
+        cached = None
+        headers = {}
+        if cache_file is not None and cache_file.exists:
+            try:
+                cached = json2value(cache_file.read())
+                if cached.etag:
+                    headers["If-None-Match"] = cached.etag
+                if cached.last_modified:
+                    headers["If-Modified-Since"] = cached.last_modified
+            except Exception as cause:
+                logger.warning("Ignoring bad cache file {file}", file=cache_file.abs_path, cause=cause)
+                cached = None
+
+        response = http.get(url, headers=headers, session=self.session)
+        span.args["status"] = response.status_code
+        if response.status_code == 304 and cached:
+            DEBUG and logger.info("{name} not modified", name=name)
+            return list(cached.releases)
+        elif response.status_code == 404:
+            return []
+        elif response.status_code != 200:
+            logger.error("Bad response {code} from {url}", code=response.status_code, url=url)
+
+        releases = list(json2value(response.content.decode("utf8")).releases.keys())
+        if cache_file is not None:
+            cache_file.write(value2json({
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "releases": releases,
+            }))
+        return releases
@@ -0,0 +1,253 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import heapq
+from statistics import median
+
+from mo_deploy.trace import PHASE, WAIT
+from mo_dots import from_data, to_data
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import logger
+from mo_threads import Lock
+
+DEBUG = False
+HISTORY = 10  # DURATIONS TO KEEP FOR EACH STEP OF EACH MODULE
+TESTS = "test"  # ALL test <version> PHASES RUN AT ONCE, SO THE SLOWEST IS THE STEP
+BEFORE_WHEEL = ["sync", "version", "build", TESTS]  # DEPENDENTS WAIT FOR THESE
+AFTER_WHEEL = ["release", "publish", "push"]
+# GUESSES FOR A STEP NO MODULE HAS RECORDED
+DEFAULT_SECONDS = {"sync": 10, "version": 5, "build": 30, TESTS: 300, "release": 5, "publish": 60, "push": 5}
+
+
+class StepHistory(object):
+    """
+    RECENT DURATIONS OF EACH deploy STEP (A tracer PHASE) OF EACH MODULE
+
+    A STEP'S DURATION IS ITS PHASE'S WALL TIME LESS THE WAITS IN THAT PHASE (FOR WORKERS,
+    OTHER MODULES, THE INDEX), SO IT IS THE WORK THE MODULE DOES, NOT WHAT IT WAITED ON
+    """
+
+    def __init__(self, file):
+        self.file = File(file)
+        self.locker = Lock("step history")
+        self.data = {}  # MAP FROM MODULE NAME TO MAP FROM STEP TO LIST OF SECONDS
+        if self.file.exists:
+            try:
+                self.data = from_data(json2value(self.file.read()))
+            except Exception as cause:
+                logger.warning("Ignoring corrupt step history {file}", file=self.file.abs_path, cause=cause)
+
+    def record_trace(self, trace):
+        """
+        ADD THE STEPS OF A TRACE (RETURNED BY tracer.stop()) TO THE HISTORY
+        """
+        events = to_data(trace).traceEvents
+        modules = {e.pid: e.args.name for e in events if e.ph == "M" and e.name == "process_name"}
+
+        steps = {}  # MAP FROM (module, step) TO SECONDS
+        for e in events:
+            if e.ph != "X":
+                continue
+            module = modules.get(e.pid)
+            if e.cat == PHASE:
+                key = module, step_of(e.name)
+                if key[1] == TESTS:
+                    # TEST PHASES RUN CONCURRENTLY, KEEP THE SLOWEST
+                    steps[key] = max(steps.get(key, 0), e.dur / 1_000_000)
+                else:
+                    steps[key] = steps.get(key, 0) + e.dur / 1_000_000
+        for e in events:
+            if e.ph == "X" and e.cat == WAIT and e.args.phase:
+                key = modules.get(e.pid), step_of(e.args.phase)
+                if key in steps and key[1] != TESTS:
+                    steps[key] -= e.dur / 1_000_000
+
+        with self.locker:
+            for (module, step), seconds in steps.items():
+                durations = self.data.setdefault(module, {}).setdefault(step, [])
+                durations.append(round(max(0, seconds), 3))
+                del durations[:-HISTORY]
+            self.file.write(value2json(self.data, pretty=True))
+        DEBUG and logger.info("Recorded {num} steps", num=len(steps))
+
+    def estimate(self, module, step):
+        """
+        :return: (seconds, known) - MEDIAN OF THE RECENT DURATIONS, OR A GUESS FROM OTHER MODULES
+        """
+        durations = self.data.get(module, {}).get(step)
+        if durations:
+            return median(durations), True
+        others = [median(d) for m, steps in self.data.items() for s, d in steps.items() if s == step and d]
+        if others:
+            return median(others), False
+        return DEFAULT_SECONDS.get(step, 0), False
+
+
+def step_of(phase):
+    """
+    :return: THE STEP FOR A PHASE NAME ("test 3.9" IS A test STEP)
+    """
+    if phase.startswith(TESTS + " "):
+        return TESTS
+    return phase
+
+
+class Plan(object):
+    """
+    PREDICT WHAT Scheduler WILL DO WITH graph.todo, USING THE StepHistory
+
+    * A MODULE STARTS WHEN THE todo MODULES IT REQUIRES HAVE A WHEEL, AND A WORKER AND ITS DIRECTORY ARE FREE
+    * IT UPLOADS WHEN ITS OWN release IS DONE AND THE todo MODULES IT REQUIRES ARE PUBLISHED
+    * THE WORKER IS HELD UNTIL push IS DONE
+    """
+
+    def __init__(self, graph, history):
+        self.graph = graph
+        self.todo = graph.todo
+        names = set(m.name for m in self.todo)
+        todo_bits = graph.dependencies.bits(names)
+        self.requires = {
+            m.name: set(graph.dependencies.names(graph.dependencies.requirement_bits(m.name) & todo_bits)) - {m.name}
+            for m in self.todo
+        }
+        self.before = {}  # SECONDS FROM START TO WHEEL
+        self.release = {}  # SECONDS FROM WHEEL TO READY FOR UPLOAD
+        self.publish = {}
+        self.push = {}
+        self.unknown = {}  # MAP FROM MODULE TO STEPS WITH NO HISTORY
+        for m in self.todo:
+            estimates = {step: history.estimate(m.name, step) for step in BEFORE_WHEEL + AFTER_WHEEL}
+            self.before[m.name] = sum(estimates[s][0] for s in BEFORE_WHEEL)
+            self.release[m.name] = estimates["release"][0]
+            self.publish[m.name] = estimates["publish"][0]
+            self.push[m.name] = estimates["push"][0]
+            self.unknown[m.name] = [s for s, (_, known) in estimates.items() if not known]
+
+    def schedule(self, max_workers=None):
+        """
+        :param max_workers: CONCURRENCY, None FOR UNLIMITED
+        :return: MAP FROM MODULE NAME TO {start, wheel, published, end, waited_on, published_by}
+                 waited_on IS (MODULE, REASON) FOR WHAT DELAYED THE START, published_by IS WHAT DELAYED THE UPLOAD
+        """
+        order = {m.name: i for i, m in enumerate(self.todo)}
+        workers = [(0, "")] * max_workers if max_workers else None  # HEAP OF (FREE AT, HELD BY)
+        directories = {}
+        timeline = {}
+        remaining = set(order.keys())
+        while remaining:
+            # NEXT IS THE STARTABLE MODULE THAT IS READY FIRST; NO OTHER CAN BE READY SOONER
+            ready, _, name = min(
+                (max([timeline[r]["wheel"] for r in self.requires[name]] + [0]), order[name], name)
+                for name in remaining
+                if all(r in timeline for r in self.requires[name])
+            )
+            remaining.discard(name)
+            waited_on = None
+            if ready:
+                waited_on = max(self.requires[name], key=lambda r: timeline[r]["wheel"]), "wheel"
+            start = ready
+            if workers is not None:
+                free, holder = heapq.heappop(workers)
+                if free > start:
+                    start, waited_on = free, (holder, "worker")
+            directory = self.graph.modules[name].directory.abs_path
+            free, holder = directories.get(directory, (0, None))
+            if free > start:
+                start, waited_on = free, (holder, "directory")
+
+            wheel = start + self.before[name]
+            upload = wheel + self.release[name]
+            published_by = max(self.requires[name], key=lambda r: timeline[r]["published"], default=None)
+            if published_by and timeline[published_by]["published"] > upload:
+                upload = timeline[published_by]["published"]
+            else:
+                published_by = None
+            published = upload + self.publish[name]
+            end = published + self.push[name]
+
+            timeline[name] = {
+                "start": start,
+                "wheel": wheel,
+                "published": published,
+                "end": end,
+                "waited_on": waited_on,
+                "published_by": published_by,
+            }
+            directories[directory] = end, name
+            if workers is not None:
+                heapq.heappush(workers, (end, name))
+        return timeline
+
+    def critical_path(self, timeline):
+        """
+        :return: LIST OF MODULE NAMES, FROM FIRST TO LAST, THAT DETERMINE THE WALL TIME
+        """
+        if not timeline:
+            return []
+        name = max(timeline.keys(), key=lambda n: timeline[n]["end"])
+        path = [name]
+        while True:
+            t = timeline[name]
+            name = t["published_by"] or (t["waited_on"] or [None])[0]
+            if name not in timeline:
+                break
+            path.append(name)
+        return list(reversed(path))
+
+    def priorities(self):
+        """
+        :return: MAP FROM MODULE NAME TO SECONDS FROM ITS START TO THE END OF THE LONGEST CHAIN OF MODULES
+                 WAITING ON IT; THE CRITICAL PATH STARTS WITH THE BIGGEST
+        """
+        required_by = {name: [] for name in self.requires}
+        for name, requires in self.requires.items():
+            for r in requires:
+                required_by[r].append(name)
+        # requires IS TRANSITIVE, SO A MODULE REQUIRES FEWER THAN ANY MODULE WAITING ON IT
+        tail = {}
+        for name in sorted(self.requires, key=lambda n: -len(self.requires[n])):
+            own = self.before[name] + self.release[name] + self.publish[name] + self.push[name]
+            waiting = max((tail[d] for d in required_by[name]), default=0)
+            tail[name] = max(own, self.before[name] + waiting)
+        return tail
+
+    def report(self, max_workers=None):
+        """
+        :return: TEXT WITH THE PREDICTED SCHEDULE, CRITICAL PATH AND WALL TIME
+        """
+        timeline = self.schedule(max_workers)
+        unlimited = self.schedule(None)
+        path = self.critical_path(timeline)
+
+        lines = [f"  {'module':<24} {'start':>8} {'wheel':>8} {'publish':>8} {'end':>8}  {'waits for':<32} guessed"]
+        for m in sorted(self.todo, key=lambda m: (timeline[m.name]["start"], m.name)):
+            t = timeline[m.name]
+            waits = ""
+            if t["published_by"]:
+                waits = f"{t['published_by']} (publish)"
+            elif t["waited_on"]:
+                waits = "{} ({})".format(*t["waited_on"])
+            unknown = self.unknown[m.name]
+            guessed = "all" if len(unknown) == len(BEFORE_WHEEL + AFTER_WHEEL) else ",".join(unknown)
+            critical = "*" if m.name in path else " "
+            lines.append(
+                f"{critical} {m.name:<24} {t['start']:>8.0f} {t['wheel']:>8.0f} {t['published']:>8.0f} {t['end']:>8.0f} "
+                f" {waits:<32} {guessed}"
+            )
+        lines.append("")
+        lines.append(f"critical path (*): {' -> '.join(path)}")
+        concurrency = max_workers or "unlimited"
+        lines.append(f"expected wall time: {wall_time(timeline):.0f} seconds with {concurrency} workers")
+        if max_workers:
+            lines.append(f"expected wall time: {wall_time(unlimited):.0f} seconds with unlimited workers")
+        return "\n".join(lines)
+
+
+def wall_time(timeline):
+    return max((t["end"] for t in timeline.values()), default=0)
@@ -0,0 +1,127 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from time import time as unix_now
+
+from mo_logs import logger
+from mo_math import randoms
+from mo_threads import Lock, Signal, Thread, Till
+from mo_threads import threads
+from pyLibrary.utils import Version
+
+DEBUG = False
+MIN_INTERVAL = 2  # SECONDS BETWEEN FIRST POLLS
+MAX_INTERVAL = 30  # BACKOFF LIMIT
+
+
+class PublishWaiter(object):
+    """
+    ONE THREAD WATCHING THE PACKAGE INDEX FOR MANY (package, version) TARGETS
+    EACH TARGET GETS A Signal THAT FIRES WHEN THE VERSION APPEARS ON THE INDEX
+    A TARGET IS NO LONGER POLLED ONCE EVERY CALLER THAT expect()ED IT HAS GIVEN UP
+    """
+
+    def __init__(self, index, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        self.index = index
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.locker = Lock("publish waiter")
+        self.targets = {}  # MAP FROM (package, version) TO _Target
+        self.wakeup = Signal()
+        self.thread = None
+
+    def expect(self, package, version, till=None):
+        """
+        :param till: Signal FOR WHEN THE CALLER GIVES UP WAITING (None FOR NEVER)
+        :return: Signal THAT FIRES WHEN package==version IS VISIBLE ON THE INDEX
+        """
+        version = Version(version)
+        key = (package, str(version))
+        with self.locker:
+            target = self.targets.get(key)
+            if not target:
+                target = self.targets[key] = _Target(package, version, self.min_interval)
+                if not self.thread:
+                    self.thread = Thread.run(
+                        "publish waiter", self._worker, parent_thread=threads.MAIN_THREAD
+                    ).release()
+                self.wakeup.go()
+            target.callers += 1
+        if till is not None:
+            till.then(lambda: self._give_up(key, target))
+        return target.found
+
+    def _give_up(self, key, target):
+        with self.locker:
+            target.callers -= 1
+            if target.callers or self.targets.get(key) is not target:
+                return
+            DEBUG and logger.info(
+                "stop polling for {package}=={version}", package=target.package, version=target.version
+            )
+            del self.targets[key]
+
+    def _worker(self, please_stop):
+        try:
+            while not please_stop:
+                try:
+                    self._poll()
+                except Exception as cause:
+                    # ONE BAD POLL MUST NOT END THE ONLY WORKER
+                    logger.warning("Problem polling index", cause=cause)
+
+                with self.locker:
+                    if self.targets:
+                        timeout = Till(till=min(t.next_poll for t in self.targets.values()))
+                    else:
+                        timeout = Till(seconds=self.max_interval)
+                    wakeup = self.wakeup = Signal()
+                (please_stop | wakeup | timeout).wait()
+        finally:
+            with self.locker:
+                # SO THE NEXT expect() STARTS ANOTHER WORKER
+                self.thread = None
+
+    def _poll(self):
+        now = unix_now()
+        with self.locker:
+            due = [t for t in self.targets.values() if t.next_poll <= now]
+
+        for package in set(t.package for t in due):
+            try:
+                versions = self.index.get_versions(package, refresh=True)
+            except Exception as cause:
+                logger.warning("Can not poll index for {package}", package=package, cause=cause)
+                versions = []
+            for t in due:
+                if t.package != package:
+                    continue
+                if t.version in versions:
+                    DEBUG and logger.info("{package}=={version} is visible", package=package, version=t.version)
+                    with self.locker:
+                        # WHILE POLLING, t MAY HAVE BEEN GIVEN UP, AND A NEW TARGET expect()ED UNDER THE SAME KEY
+                        current = self.targets.pop((t.package, str(t.version)), None)
+                    t.found.go()
+                    if current is not None:
+                        current.found.go()
+                else:
+                    # EXPONENTIAL BACKOFF, WITH JITTER SO MANY TARGETS DO NOT POLL IN LOCKSTEP
+                    t.interval = min(t.interval * 2, self.max_interval)
+                    t.next_poll = unix_now() + t.interval * (0.5 + randoms.float())
+
+
+class _Target(object):
+    __slots__ = ["package", "version", "found", "interval", "next_poll", "callers"]
+
+    def __init__(self, package, version, interval):
+        self.package = package
+        self.version = version
+        self.found = Signal(f"{package}=={version} is visible")
+        self.interval = interval
+        self.next_poll = unix_now()
+        self.callers = 0  # THAT HAVE NOT GIVEN UP
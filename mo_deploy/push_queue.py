@@ -0,0 +1,126 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from mo_logs import logger, Except
+from mo_threads import Lock, Thread, join_all_threads
+
+DEBUG = False
+MAX_WORKERS = 8  # REPOSITORIES PUSHED AT ONCE
+REMOTE = "origin"
+
+
+class PushQueue(object):
+    """
+    PENDING git push OF EACH REPOSITORY, SO THE PUSHES ARE OFF THE DEPLOY'S CRITICAL PATH
+
+    * A REF IS PUSHED AS IT IS WHEN flush() IS CALLED, SO MANY UPDATES TO ONE REF ARE ONE PUSH
+    * THE LAST REQUEST FOR A REF WINS (A delete() AFTER A push() DELETES)
+    * flush() RUNS ONE git push PER REPOSITORY, FOR ALL ITS REFS, WITH REPOSITORIES PUSHED CONCURRENTLY
+    * flush(module) PUSHES ONLY THE REPOSITORY OF module
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self.locker = Lock("push queue")
+        self.pending = {}  # MAP FROM DIRECTORY TO _Pending
+
+    def push(self, module, ref, tag=False, force=False):
+        """
+        :param module: Module OWNING THE REPOSITORY
+        :param ref: BRANCH OR TAG NAME
+        :param tag: True IF ref IS A TAG
+        :param force: True TO REPLACE WHAT THE REMOTE HAS
+        """
+        full_ref = _full_ref(ref, tag)
+        with self.locker:
+            self._pending(module).refs[full_ref] = ("+" if force else "") + full_ref + ":" + full_ref
+        DEBUG and logger.info("queue push of {ref} for {module}", ref=full_ref, module=module.name)
+
+    def delete(self, module, ref, tag=False):
+        full_ref = _full_ref(ref, tag)
+        with self.locker:
+            self._pending(module).refs[full_ref] = ":" + full_ref
+
+    def discard(self, module, refs, tag=False):
+        """
+        FORGET PENDING UPDATES OF refs (LIKE WHEN THE LOCAL REF WAS ROLLED BACK)
+        """
+        with self.locker:
+            pending = self.pending.get(module.directory.abs_path)
+            if not pending:
+                return
+            for ref in refs:
+                pending.refs.pop(_full_ref(ref, tag), None)
+
+    def _pending(self, module):
+        # EXPECTS self.locker
+        key = module.directory.abs_path
+        pending = self.pending.get(key)
+        if not pending:
+            pending = self.pending[key] = _Pending(module)
+        pending.modules.add(module.name)
+        return pending
+
+    def flush(self, module=None):
+        """
+        PUSH EVERYTHING PENDING
+        :param module: PUSH ONLY THE REPOSITORY OF module (DEFAULT IS ALL REPOSITORIES)
+        :return: MAP FROM MODULE NAME TO THE Except OF ITS FAILED PUSH
+        """
+        with self.locker:
+            if module is None:
+                todo = [p for p in self.pending.values() if p.refs]
+                self.pending = {}
+            else:
+                pending = self.pending.pop(module.directory.abs_path, None)
+                todo = [pending] if pending and pending.refs else []
+        if not todo:
+            return {}
+
+        failed = {}
+        work = list(todo)
+
+        def pusher(please_stop):
+            while not please_stop:
+                with self.locker:
+                    if not work:
+                        return
+                    pending = work.pop(0)
+                module = pending.module
+                refspecs = list(pending.refs.values())
+                try:
+                    module.local([module.git, "push", REMOTE, *refspecs])
+                except Exception as cause:
+                    cause = Except.wrap(cause)
+                    logger.warning(
+                        "git {remote} not updated for {dir}",
+                        remote=REMOTE,
+                        dir=module.directory.abs_path,
+                        cause=cause,
+                    )
+                    with self.locker:
+                        for name in pending.modules:
+                            failed[name] = cause
+
+        join_all_threads(Thread.run(f"git push {i}", pusher) for i in range(min(self.max_workers, len(todo))))
+        return failed
+
+
+class _Pending(object):
+    __slots__ = ["module", "modules", "refs"]
+
+    def __init__(self, module):
+        self.module = module  # RUNS THE PUSH
+        self.modules = set()  # NAMES OF ALL MODULES IN THIS REPOSITORY
+        self.refs = {}  # MAP FROM FULL REF NAME TO REFSPEC, IN ORDER OF FIRST REQUEST
+
+
+def _full_ref(ref, tag):
+    if ref.startswith("refs/"):
+        return ref
+    return ("refs/tags/" if tag else "refs/heads/") + ref
@@ -0,0 +1,156 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+from mo_logs import logger, Except
+from mo_deploy.module import PUBLISH_TIMEOUT
+from mo_deploy.trace import tracer, WAIT
+from mo_threads import Lock, Signal, Thread, Queue, Till
+
+
+class Scheduler(object):
+    """
+    DEPLOY THE graph.todo MODULES CONCURRENTLY, IN DEPENDENCY ORDER
+
+    * A MODULE STARTS AS SOON AS THE todo MODULES IT REQUIRES HAVE A TESTED WHEEL IN THE WHEELHOUSE
+    * A MODULE UPLOADS ONLY AFTER THE todo MODULES IT REQUIRES ARE VISIBLE ON THE INDEX
+    * A FAILED MODULE CANCELS ONLY THE MODULES THAT DEPEND ON IT
+    * MODULES SHARING A REPOSITORY DIRECTORY ARE DEPLOYED ONE AT A TIME
+    * A MODULE PUSHES ITS REPOSITORY WHEN ITS DEPLOY IS DONE; A FAILED PUSH IS A FAILED DEPLOY
+    """
+
+    def __init__(self, graph, max_workers=None, priorities=None):
+        """
+        :param priorities: MAP FROM MODULE NAME TO PRIORITY OF ITS COMMANDS (SEE Plan.priorities)
+        """
+        self.graph = graph
+        self.todo = graph.todo
+        for m in self.todo:
+            m.priority = (priorities or {}).get(m.name, 0)
+        names = set(m.name for m in self.todo)
+        # TRANSITIVE REQUIREMENTS, SO WAITING ON ALL OF THEM IS THE SAME AS WAITING ON THE DIRECT ONES
+        todo_bits = graph.dependencies.bits(names)
+        self.requires = {
+            m.name: set(graph.dependencies.names(graph.dependencies.requirement_bits(m.name) & todo_bits)) - {m.name}
+            for m in self.todo
+        }
+        self.done = {name: Signal(f"{name} is deployed") for name in names}
+        self.failed = {}  # MAP FROM MODULE NAME TO THE REASON IT DID NOT DEPLOY
+        self.locker = Lock("scheduler")
+        self.directory_locks = {}
+        self.workers = None
+        if max_workers:
+            self.workers = Queue("deploy workers", max=max_workers)
+            for i in range(max_workers):
+                self.workers.add(i)
+
+    def run(self):
+        """
+        DEPLOY EVERYTHING, RAISE IF ANY MODULE DID NOT DEPLOY
+        """
+        threads = [Thread.run("deploy " + m.name, self._deploy, m) for m in self.todo]
+        for t in threads:
+            t.join()
+        # WHATEVER IS LEFT, ONE PUSH PER REPOSITORY
+        with tracer.phase("push"):
+            self._push_failed(self.graph.push_queue.flush())
+        if self.failed:
+            logger.error(
+                "Did not deploy {modules}", modules=list(self.failed.keys()), cause=list(self.failed.values()),
+            )
+
+    def _push_failed(self, failed):
+        """
+        :param failed: MAP FROM MODULE NAME TO THE Except OF ITS FAILED PUSH
+        """
+        with self.locker:
+            for name, cause in failed.items():
+                if name in self.done:
+                    self.failed.setdefault(name, cause)
+
+    def _directory_lock(self, module):
+        with self.locker:
+            key = module.directory.abs_path
+            lock = self.directory_locks.get(key)
+            if not lock:
+                lock = self.directory_locks[key] = Lock(f"deploy in {key}")
+            return lock
+
+    def _wait_for_published(self, module):
+        """
+        BLOCK UNTIL ALL REQUIREMENTS OF module ARE VISIBLE ON THE INDEX
+        """
+        for r in self.requires[module.name]:
+            version = self.graph.get_next_version(r)
+            gave_up = Signal()
+            found = self.graph.publish_waiter.expect(self.graph.modules[r].package_name, version, till=gave_up)
+            try:
+                with tracer.span(f"wait for {r} on index", WAIT, requirement=r, version=str(version)):
+                    (found | self.done[r]).wait()
+                if not found and r not in self.failed:
+                    # DEPLOY GAVE UP WAITING, BUT IT MAY STILL SHOW
+                    found.wait(till=Till(seconds=PUBLISH_TIMEOUT))
+            finally:
+                gave_up.go()
+            if not found:
+                logger.error(
+                    "{module} requires {requirement}=={version}, which is not published",
+                    module=module.name,
+                    requirement=r,
+                    version=version,
+                )
+
+    def _deploy(self, module, please_stop):
+        with tracer.phase("deploy", module=module.name):
+            self._deploy_after_requirements(module, please_stop)
+
+    def _deploy_after_requirements(self, module, please_stop):
+        name = module.name
+        try:
+            wheelhouse = self.graph.wheelhouse
+            for r in self.requires[name]:
+                package_name = self.graph.modules[r].package_name
+                with tracer.span(f"wait for {r} wheel", WAIT, requirement=r):
+                    (self.done[r] | wheelhouse.available(package_name)).wait(till=please_stop)
+            if please_stop:
+                return
+
+            blocked = sorted(r for r in self.requires[name] if r in self.failed)
+            if blocked:
+                logger.warning(
+                    "Skip {module} because {blocked} did not deploy", module=name, blocked=blocked,
+                )
+                with self.locker:
+                    self.failed[name] = Except(template="requirement {{blocked}} did not deploy", params={"blocked": blocked})
+                return
+
+            worker = None
+            if self.workers is not None:
+                with tracer.span("wait for worker", WAIT):
+                    worker = self.workers.pop(till=please_stop)
+                if please_stop:
+                    return
+            try:
+                directory_lock = self._directory_lock(module)
+                with tracer.acquire("wait for directory", directory_lock, directory=module.directory.abs_path):
+                    logger.alert(
+                        "DEPLOY {{module|upper}} - {{version}}", module=name, version=self.graph.get_next_version(name),
+                    )
+                    module.deploy(before_upload=lambda: self._wait_for_published(module))
+                    # STILL IN THE DIRECTORY LOCK, SO NO OTHER MODULE OF THIS REPOSITORY IS PART WAY
+                    with tracer.phase("push", module=name):
+                        self._push_failed(self.graph.push_queue.flush(module))
+            finally:
+                if worker is not None:
+                    self.workers.add(worker)
+        except Exception as cause:
+            cause = Except.wrap(cause)
+            logger.warning("Can not deploy {module}", module=name, cause=cause)
+            with self.locker:
+                self.failed[name] = cause
+        finally:
+            self.done[name].go()
@@ -0,0 +1,173 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import os
+from functools import wraps
+from time import time as unix_now
+
+from mo_dots import from_data
+from mo_files import File
+from mo_json import value2json, json2value
+from mo_logs import logger
+from mo_threads import Lock
+
+DEBUG = False
+MISSING = object()
+COMPACT_RATIO = 2  # REWRITE THE LOG WHEN IT HAS THIS MANY LINES PER PROBE ...
+COMPACT_SLACK = 100  # ... PLUS THIS MANY
+REF_MOVING_COMMANDS = {
+    "am", "branch", "checkout", "cherry-pick", "commit", "fetch", "merge", "pull", "push", "rebase", "reset",
+    "revert", "stash", "switch", "tag", "update-ref",
+}
+
+
+class StateStore(object):
+    """
+    ON-DISK MEMO OF Module PROBES (git tag, git show, pypi, ...)
+
+    EACH PROBE IS STORED WITH THE signature (HASH OF ALL REFS) OF ITS REPOSITORY; WHEN THE REFS MOVE
+    THE SIGNATURE CHANGES AND THE PROBE IS COMPUTED AGAIN
+
+    THE FILE IS A LOG, ONE JSON LINE PER set(), SO A WRITE IS AN APPEND.  IT IS COMPACTED WHEN LOADED
+    """
+
+    def __init__(self, file):
+        self.file = File(file)
+        self.locker = Lock("state store " + self.file.abs_path)
+        self.data = {}  # MAP FROM (repo, key) TO {"signature", "timestamp", "value"}
+        if not self.file.exists:
+            return
+        lines = 0
+        corrupt = 0
+        for line in self.file.read_lines():
+            if not line:
+                continue
+            lines += 1
+            try:
+                record = from_data(json2value(line))
+                self.data[(record["repo"], record["key"])] = {
+                    "signature": record["signature"],
+                    "timestamp": record["timestamp"],
+                    "value": record["value"],
+                }
+            except Exception:
+                corrupt += 1
+        if corrupt:
+            logger.warning(
+                "Ignoring {num} corrupt lines in state file {file}", num=corrupt, file=self.file.abs_path,
+            )
+        if corrupt or lines > COMPACT_RATIO * len(self.data) + COMPACT_SLACK:
+            self._compact()
+
+    def get(self, repo, signature, key, max_age=None):
+        with self.locker:
+            probe = self.data.get((repo, key))
+            if not probe or probe["signature"] != signature:
+                return MISSING
+            if max_age is not None and probe["timestamp"] + max_age < unix_now():
+                return MISSING
+            return probe["value"]
+
+    def set(self, repo, signature, key, value):
+        with self.locker:
+            probe = self.data[(repo, key)] = {"signature": signature, "timestamp": unix_now(), "value": value}
+            self.file.append(_line(repo, key, probe))
+
+    def _compact(self):
+        DEBUG and logger.info("compact state file {file}", file=self.file.abs_path)
+        self.file.write("".join(_line(repo, key, probe) + "\n" for (repo, key), probe in self.data.items()))
+
+
+def _line(repo, key, probe):
+    return value2json({"repo": repo, "key": key, **probe})
+
+
+class RefsSignatures(object):
+    """
+    signature OF EACH REPOSITORY, SO git show-ref RUNS ONCE UNTIL A COMMAND OF THIS PROCESS MOVES THE REFS
+    (SEE moves_refs()).  REFS MOVED BY ANOTHER PROCESS ARE NOT SEEN UNTIL THE NEXT RUN
+    """
+
+    def __init__(self):
+        self.locker = Lock("refs signatures")
+        self.generation = {}  # MAP FROM repo TO NUMBER OF TIMES ITS REFS MOVED
+        self.signatures = {}  # MAP FROM repo TO (generation, signature)
+
+    def get(self, repo, compute):
+        """
+        :param compute: FUNCTION THAT RETURNS THE CURRENT signature
+        """
+        with self.locker:
+            generation = self.generation.get(repo, 0)
+            found = self.signatures.get(repo)
+            if found and found[0] == generation:
+                return found[1]
+        signature = compute()
+        with self.locker:
+            # NOT KEPT IF THE REFS MOVED WHILE COMPUTING
+            if self.generation.get(repo, 0) == generation:
+                self.signatures[repo] = (generation, signature)
+        return signature
+
+    def moved(self, repo):
+        with self.locker:
+            self.generation[repo] = self.generation.get(repo, 0) + 1
+            self.signatures.pop(repo, None)
+
+    def clear(self):
+        with self.locker:
+            self.signatures.clear()
+
+
+refs_signatures = RefsSignatures()
+
+
+def moves_refs(args):
+    """
+    True IF THE git COMMAND MAY MOVE A BRANCH, TAG, REMOTE-TRACKING REF OR HEAD
+    """
+    words = [os.path.splitext(os.path.basename(str(a)))[0] for a in args[:1]] + [str(a) for a in args[1:2]]
+    return words[0] == "git" and len(words) > 1 and words[1] in REF_MOVING_COMMANDS
+
+
+def stored(encode=str, decode=None, max_age=None):
+    """
+    PERSIST THE RESULT OF A Module METHOD IN Module.state, UNTIL THE MODULE'S REPOSITORY REFS MOVE
+
+    :param encode: CONVERT RESULT TO JSON-ABLE VALUE
+    :param decode: CONVERT JSON-ABLE VALUE BACK TO RESULT
+    :param max_age: SECONDS BEFORE THE RESULT IS STALE, FOR PROBES THAT DEPEND ON MORE THAN THE REPOSITORY
+    """
+    if max_age is not None and not isinstance(max_age, (int, float)):
+        max_age = max_age.seconds
+
+    def wrapper(func):
+        name = func.__name__
+
+        @wraps(func)
+        def output(self, *args):
+            store = self.state
+            if store is None:
+                return func(self, *args)
+            repo = self.directory.abs_path
+            key = f"{self.name}.{name}({','.join(str(a) for a in args)})"
+
+            # THE RESULT IS FOR THE REFS AS THEY ARE BEFORE COMPUTING, EVEN IF THEY MOVE WHILE COMPUTING
+            signature = self.refs_signature()
+            value = store.get(repo, signature, key, max_age)
+            if value is not MISSING:
+                DEBUG and logger.info("stored {key} = {value}", key=key, value=value)
+                return decode(value) if decode else value
+
+            result = func(self, *args)
+            store.set(repo, signature, key, encode(result))
+            return result
+
+        return output
+
+    return wrapper
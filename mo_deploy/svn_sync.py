@@ -0,0 +1,91 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import os
+
+from mo_dots import listwrap
+from mo_files import File
+from mo_files.walk import Ignore
+from mo_logs import logger
+from mo_threads import Lock, Thread, join_all_threads
+
+DEBUG = False
+SVN = ".svn"
+# NEVER HOLD A WORKING COPY WORTH SYNCING, AND CAN BE HUGE
+PRUNE = Ignore([".git/", ".hg/", "__pycache__/", "node_modules/", ".tox/", ".venv/", ".pytest_cache/", ".idea/"])
+MAX_WORKERS = 4  # svn update AT ONCE, PER REPOSITORY
+COMMIT_BATCH = 40  # WORKING COPIES PER svn commit, TO STAY UNDER THE COMMAND LINE LIMIT
+
+
+def find_working_copies(directory, ignore=None):
+    """
+    :param directory: WHERE TO LOOK
+    :param ignore: SUBSTRINGS OF PATHS TO SKIP (SEE Module.ignore_svn)
+    :return: LIST OF os PATHS OF THE svn WORKING COPY ROOTS UNDER directory
+
+    IGNORED, VCS-INTERNAL AND CACHE DIRECTORIES ARE NOT ENTERED, AND NEITHER IS A WORKING COPY
+    (svn update OF THE ROOT COVERS ITS SUBDIRECTORIES)
+    """
+    ignore = listwrap(ignore)
+    root = File(directory)
+    prefix = root.abs_path + "/"
+    found = {}  # MAP FROM RELATIVE PATH TO os PATH
+
+    def prune(entry):
+        if entry.parent in found:
+            return True
+        path = prefix + entry.path + "/"
+        if any(i in path for i in ignore):
+            DEBUG and logger.info("Ignoring {dir}", dir=path)
+            return True
+        return False
+
+    for entry in root.walk(ignore=PRUNE, prune=prune, directories=True):
+        if entry.name == SVN:
+            found[entry.parent] = os.path.dirname(entry.os_path)
+    return sorted(found.values())
+
+
+def sync_working_copies(module, working_copies):
+    """
+    svn update THE working_copies CONCURRENTLY, THEN COMMIT THE ONES WITH LOCAL CHANGES IN BATCHES
+    :param module: THE Module THAT OWNS THE working_copies
+    """
+    if not working_copies:
+        return
+    todo = list(working_copies)
+    dirty = []
+    locker = Lock("svn working copies")
+
+    def update(please_stop):
+        while not please_stop:
+            with locker:
+                if not todo:
+                    return
+                svn_dir = todo.pop(0)
+            logger.info("Update svn directory {{dir}}", dir=svn_dir)
+            module.local([module.svn, "update", "--accept", "p", svn_dir])
+            # ONLY COMMIT WHAT HAS CHANGED; A COMMIT OF NOTHING STILL TALKS TO THE SERVER
+            p, stdout, stderr = module.local([module.svn, "status", "-q", svn_dir])
+            if any(line.strip() for line in stdout):
+                with locker:
+                    dirty.append(svn_dir)
+
+    join_all_threads(
+        Thread.run(f"svn update {module.name} {i}", update) for i in range(min(MAX_WORKERS, len(working_copies)))
+    )
+
+    dirty.sort()
+    for start in range(0, len(dirty), COMMIT_BATCH):
+        batch = dirty[start : start + COMMIT_BATCH]
+        p, stdout, stderr = module.local([module.svn, "commit", *batch, "-m", "auto"], raise_on_error=False)
+        if p.returncode:
+            # OLDER svn, OR WORKING COPIES FROM DIFFERENT REPOSITORIES, MUST COMMIT ONE AT A TIME
+            logger.info("Commit {num} svn directories one at a time", num=len(batch))
+            for svn_dir in batch:
+                module.local([module.svn, "commit", svn_dir, "-m", "auto"])
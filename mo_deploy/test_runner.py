@@ -0,0 +1,276 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+"""
+RUN unittest TEST MODULES IN PARALLEL WORKER PROCESSES, AND WRITE A JSON REPORT
+
+THIS FILE RUNS INSIDE THE TEST virtualenv, SO IT MAY ONLY USE THE STANDARD LIBRARY
+
+    python test_runner.py --workers 4 --timings timings.json --report report.json tests
+
+* TEST MODULES ARE FOUND LIKE `python -m unittest discover tests`
+* A MODULE IS NEVER SPLIT, SO setUpModule/setUpClass RUN ONCE
+* MODULES ARE ASSIGNED TO WORKERS LONGEST-FIRST, USING THE DURATIONS IN THE timings FILE
+* THE timings FILE IS UPDATED WITH THE DURATIONS OF THIS RUN
+* EXIT CODE IS ZERO ONLY IF SOME TESTS RAN, AND ALL PASSED
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import traceback
+import unittest
+from time import time as unix_now
+
+PASS = "pass"
+FAIL = "fail"
+ERROR = "error"
+SKIP = "skip"
+EXPECTED_FAILURE = "expected failure"
+UNEXPECTED_SUCCESS = "unexpected success"
+BAD = {FAIL, ERROR, UNEXPECTED_SUCCESS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="parallel unittest runner")
+    parser.add_argument("start", nargs="?", default="tests", help="directory to discover tests in")
+    parser.add_argument("--pattern", default="test*.py")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--timings", help="json file of module durations, read and updated")
+    parser.add_argument("--report", help="json file to write results")
+    parser.add_argument("--modules", nargs="*", help="run only these test modules")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.exit(run_worker(args.start, args.modules, args.report))
+    sys.exit(run_all(args.start, args.pattern, args.workers, args.timings, args.report, args.modules))
+
+
+def run_all(start, pattern, num_workers, timings_file, report_file, only=None):
+    start_time = unix_now()
+    modules = discover(start, pattern)
+    if only is not None:
+        modules = [m for m in modules if m in set(only)]
+    timings = read_json(timings_file) or {}
+    shards = plan_shards(modules, timings, num_workers)
+
+    # START ALL WORKERS, EACH WRITES ITS OWN REPORT
+    temp = tempfile.mkdtemp(prefix="test-runner-")
+    workers = []
+    for i, shard in enumerate(shards):
+        shard_report = os.path.join(temp, f"shard{i}.json")
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), start, "--worker", "--report", shard_report, "--modules", *shard]
+        )
+        workers.append((process, shard, shard_report))
+
+    tests = []
+    for process, shard, shard_report in workers:
+        process.wait()
+        result = read_json(shard_report)
+        if result is None:
+            # WORKER DIED; BLAME EVERY MODULE IN THE SHARD
+            result = [
+                {
+                    "id": module,
+                    "module": module,
+                    "status": ERROR,
+                    "duration": 0,
+                    "message": f"worker exited with code {process.returncode} before reporting",
+                }
+                for module in shard
+            ]
+        tests.extend(result)
+        try:
+            os.remove(shard_report)
+        except Exception:
+            pass
+    try:
+        os.rmdir(temp)
+    except Exception:
+        pass
+
+    # DURATION OF EACH MODULE, FOR NEXT TIME
+    durations = {}
+    for t in tests:
+        durations[t["module"]] = durations.get(t["module"], 0) + t["duration"]
+    if timings_file:
+        timings.update(durations)
+        write_json(timings_file, timings)
+
+    counts = {}
+    for t in tests:
+        counts[t["status"]] = counts.get(t["status"], 0) + 1
+    bad = [t for t in tests if t["status"] in BAD]
+    report = {
+        "summary": {
+            "total": len(tests),
+            "passed": not bad and bool(tests),
+            "counts": counts,
+            "workers": len(shards),
+            "duration": unix_now() - start_time,
+        },
+        "shards": [{"modules": shard, "expected": sum(timings.get(m, 0) for m in shard)} for shard in shards],
+        "modules": durations,
+        "tests": tests,
+    }
+    if report_file:
+        write_json(report_file, report)
+
+    for t in bad:
+        sys.stderr.write(f"{t['status'].upper()}: {t['id']}\n{t.get('message') or ''}\n")
+    sys.stderr.write(
+        f"Ran {len(tests)} tests in {report['summary']['duration']:.3f}s using {len(shards)} workers\n"
+        + ("OK\n" if report["summary"]["passed"] else "FAILED\n")
+    )
+    return 0 if report["summary"]["passed"] else 1
+
+
+def discover(start, pattern):
+    """
+    :return: NAMES OF THE TEST MODULES FOUND UNDER start, AS `unittest discover start` WOULD IMPORT THEM
+    """
+    sys.path.insert(0, os.path.abspath(start))
+    suite = unittest.defaultTestLoader.discover(start, pattern=pattern)
+    modules = []
+    for test in _flatten(suite):
+        module = _module_of(test)
+        if module not in modules:
+            modules.append(module)
+    return modules
+
+
+def plan_shards(modules, timings, num_workers):
+    """
+    LONGEST-PROCESSING-TIME-FIRST: LONGEST MODULES FIRST, EACH TO THE LEAST-LOADED WORKER
+    MODULES WITHOUT A TIMING ARE ASSUMED TO BE LONG, SO THEY START EARLY
+    """
+    if not modules:
+        return []
+    known = [timings[m] for m in modules if m in timings]
+    unknown = max(known) if known else 1
+    ordered = sorted(modules, key=lambda m: -timings.get(m, unknown))
+    num_workers = max(1, min(num_workers, len(modules)))
+    shards = [[] for _ in range(num_workers)]
+    loads = [0] * num_workers
+    for m in ordered:
+        i = loads.index(min(loads))
+        shards[i].append(m)
+        loads[i] += timings.get(m, unknown)
+    return shards
+
+
+def run_worker(start, modules, report_file):
+    sys.path.insert(0, os.path.abspath(start))
+    loader = unittest.TestLoader()
+    result = _JsonResult()
+    for module in modules or []:
+        try:
+            suite = loader.loadTestsFromName(module)
+        except Exception:
+            result.record(module, module, ERROR, 0, traceback.format_exc())
+            continue
+        result.module = module
+        suite.run(result)
+    write_json(report_file, result.tests)
+    return 0
+
+
+class _JsonResult(unittest.TestResult):
+    """
+    RECORD EACH TEST, WITH ITS DURATION
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tests = []
+        self.module = None  # MODULE BEING RUN, FOR FIXTURE ERRORS THAT ARE NOT A TEST
+        self.started = None
+
+    def record(self, test_id, module, status, duration, message=None):
+        self.tests.append({"id": test_id, "module": module, "status": status, "duration": duration, "message": message})
+
+    def _done(self, test, status, message=None):
+        duration = unix_now() - self.started if self.started else 0
+        self.started = None
+        self.record(test.id(), self.module or _module_of(test), status, duration, message)
+
+    def startTest(self, test):
+        super().startTest(test)
+        self.started = unix_now()
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._done(test, PASS)
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._done(test, FAIL, self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        # ERRORS IN setUpClass/setUpModule ARE REPORTED AGAINST A PLACEHOLDER, NOT A TEST
+        self._done(test, ERROR, self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._done(test, SKIP, reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._done(test, EXPECTED_FAILURE)
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._done(test, UNEXPECTED_SUCCESS)
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            status = FAIL if issubclass(err[0], test.failureException) else ERROR
+            self.record(subtest.id(), self.module or _module_of(test), status, 0, self._exc_info_to_string(err, test))
+
+
+def _flatten(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _flatten(test)
+        else:
+            yield test
+
+
+def _module_of(test):
+    module = type(test).__module__
+    if module == "unittest.loader":
+        # _FailedTest FOR A MODULE THAT COULD NOT BE IMPORTED
+        return test._testMethodName
+    return module
+
+
+def read_json(filename):
+    if not filename or not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, "r", encoding="utf8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def write_json(filename, value):
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    with open(filename, "w", encoding="utf8") as f:
+        json.dump(value, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
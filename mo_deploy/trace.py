@@ -0,0 +1,236 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import threading
+from contextlib import ExitStack, contextmanager
+from time import perf_counter, thread_time, time as unix_now
+
+from mo_files import File
+from mo_json import value2json
+from mo_logs import logger
+from mo_threads import Lock
+
+DEBUG = False
+PHASE = "phase"  # CATEGORY OF SPANS THAT NAME A STEP OF THE DEPLOY
+COMMAND = "command"
+HTTP = "http"
+WAIT = "wait"
+GIT = "git"
+SLOWEST = 5  # SPANS PER MODULE IN THE SUMMARY
+
+
+class Tracer(object):
+    """
+    RECORD SPANS (NAMED INTERVALS OF WORK) WHILE DEPLOYING
+
+    * EACH SPAN HAS A module, phase, thread, WALL TIME AND CPU TIME (OF THE THREAD, NOT OF CHILD PROCESSES,
+      SO COMMAND SPANS HAVE NO CPU TIME)
+    * module AND phase ARE INHERITED FROM THE ENCLOSING SPAN ON THE SAME THREAD
+    * stop() RETURNS THE TRACE EVENTS, AND IF GIVEN A FILE, WRITES THEM AS JSON (chrome://tracing,
+      https://ui.perfetto.dev, speedscope) WITH A TABLE OF THE SLOWEST SPANS OF EACH MODULE
+
+    DISABLED UNTIL start(), AND span() IS CHEAP WHILE DISABLED
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.filename = None
+        self.locker = Lock("tracer")
+        self.spans = []
+        self.local = threading.local()
+        self.start_time = None
+        self.start_counter = None
+
+    @property
+    def enabled(self):
+        return self.recording
+
+    def start(self, filename=None):
+        """
+        :param filename: WHERE stop() WRITES THE TRACE, None TO KEEP IT IN MEMORY
+        """
+        with self.locker:
+            self.recording = True
+            self.filename = File(filename) if filename else None
+            self.spans = []
+            self.start_time = unix_now()
+            self.start_counter = perf_counter()
+        if self.filename is not None:
+            logger.info("Tracing to {file}", file=self.filename.abs_path)
+
+    def span(self, name, category, module=None, **args):
+        """
+        :param name: WHAT IS BEING DONE
+        :param category: ONE OF PHASE, COMMAND, HTTP, WAIT, GIT
+        :param module: NAME OF MODULE, DEFAULT IS THE MODULE OF THE ENCLOSING SPAN
+        :param args: MORE DETAIL; THE SPAN'S args MAY BE UPDATED BEFORE THE SPAN ENDS
+        :return: CONTEXT MANAGER
+        """
+        if not self.recording:
+            return NO_SPAN
+        return _Span(self, name, category, module, args)
+
+    def phase(self, name, module=None):
+        return self.span(name, PHASE, module=module)
+
+    @contextmanager
+    def acquire(self, name, lock, module=None, **args):
+        """
+        HOLD lock FOR THE with BLOCK; THE WAIT SPAN IS ONLY THE TIME SPENT WAITING FOR IT
+        """
+        with ExitStack() as held:
+            with self.span(name, WAIT, module=module, **args):
+                held.enter_context(lock)
+            yield
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def stop(self):
+        """
+        STOP RECORDING, AND WRITE THE TRACE AND THE SUMMARY IF start() WAS GIVEN A FILE
+        :return: THE TRACE EVENTS (SEE trace_events()), None IF NOT RECORDING
+        """
+        with self.locker:
+            recording, self.recording = self.recording, False
+            filename, self.filename = self.filename, None
+            spans, self.spans = self.spans, []
+        if not recording:
+            return None
+
+        trace = self.trace_events(spans)
+        if filename is not None:
+            filename.write(value2json(trace))
+            summary = self.summary(spans)
+            File(filename.abs_path + ".txt").write(summary)
+            logger.info("Trace written to {file}\n{summary}", file=filename.abs_path, summary=summary)
+        return trace
+
+    def trace_events(self, spans):
+        """
+        :return: TRACE-EVENT FORMAT, ONE "PROCESS" PER MODULE, SO EACH MODULE GETS ITS OWN LANE
+        """
+        pids = {}
+        events = []
+        threads = set()
+        for s in spans:
+            pid = pids.get(s.module)
+            if pid is None:
+                pid = pids[s.module] = len(pids) + 1
+                events.append({
+                    "ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": s.module or "mo-deploy"}
+                })
+            if (pid, s.tid) not in threads:
+                threads.add((pid, s.tid))
+                events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": s.tid, "args": {"name": s.thread}})
+            events.append({
+                "ph": "X",
+                "name": s.name,
+                "cat": s.category,
+                "pid": pid,
+                "tid": s.tid,
+                "ts": round(s.start * 1_000_000),
+                "dur": round(s.duration * 1_000_000),
+                "args": {"phase": s.phase, **({} if s.cpu is None else {"cpu": round(s.cpu, 6)}), **s.args},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"start": self.start_time}}
+
+    def summary(self, spans, slowest=SLOWEST):
+        """
+        :return: TEXT TABLE OF THE SLOWEST STEPS (NOT PHASES) OF EACH MODULE
+        """
+        by_module = {}
+        for s in spans:
+            if s.category != PHASE:
+                by_module.setdefault(s.module or "mo-deploy", []).append(s)
+
+        lines = [f"{'module':<24} {'phase':<16} {'category':<8} {'wall':>9} {'cpu':>8}  step"]
+        for module, module_spans in sorted(by_module.items(), key=lambda p: -sum(s.duration for s in p[1])):
+            total = sum(s.duration for s in module_spans)
+            lines.append(f"{module:<24} {'(all)':<16} {'':<8} {total:>9.2f} {'':>8}  {len(module_spans)} steps")
+            for s in sorted(module_spans, key=lambda s: -s.duration)[:slowest]:
+                detail = " ".join(str(a) for a in s.args.get("argv", [])) or s.args.get("url") or ""
+                cpu = "" if s.cpu is None else f"{s.cpu:.2f}"
+                lines.append(
+                    f"{'':<24} {(s.phase or ''):<16} {s.category:<8} {s.duration:>9.2f} {cpu:>8}  {s.name} {detail}"[:200]
+                )
+        return "\n".join(lines)
+
+
+class _Span(object):
+    __slots__ = ["tracer", "name", "category", "module", "phase", "args", "thread", "tid", "start", "duration", "cpu", "_cpu"]
+
+    def __init__(self, tracer, name, category, module, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.module = module
+        self.phase = None
+        self.args = args
+        self.duration = 0
+        self.cpu = 0
+
+    def __enter__(self):
+        tracer = self.tracer
+        stack = tracer._stack()
+        parent = stack[-1] if stack else None
+        if self.module is None and parent is not None:
+            self.module = parent.module
+        if self.category == PHASE:
+            self.phase = self.name
+        elif parent is not None:
+            self.phase = parent.phase
+        current = threading.current_thread()
+        self.thread = current.name
+        self.tid = current.ident
+        stack.append(self)
+        self._cpu = thread_time()
+        self.start = perf_counter() - (tracer.start_counter or 0)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        tracer = self.tracer
+        self.duration = perf_counter() - (tracer.start_counter or 0) - self.start
+        # THE WORK OF A COMMAND IS IN ANOTHER PROCESS (OFTEN A POOLED SHELL THAT OUTLIVES IT), SO THE THREAD'S
+        # CPU TIME IS ONLY THE WAITING; getrusage(RUSAGE_CHILDREN) IS NO BETTER, IT MIXES CONCURRENT COMMANDS
+        self.cpu = None if self.category == COMMAND else thread_time() - self._cpu
+        if exc_type is not None:
+            self.args["error"] = str(exc_val)[:200]
+        stack = tracer._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if tracer.recording:
+            with tracer.locker:
+                tracer.spans.append(self)
+        DEBUG and logger.info("{name} took {duration} seconds", name=self.name, duration=self.duration)
+
+
+class _NoSpan(object):
+    """
+    WHEN NOT TRACING; SHARED BY ALL THREADS, SO IT HAS NO STATE
+    """
+
+    __slots__ = []
+
+    @property
+    def args(self):
+        # A NEW dict EACH TIME, SO WHAT IS SET IS DROPPED
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NO_SPAN = _NoSpan()
+tracer = Tracer()
@@ -11,9 +11,19 @@ import re
 
 from mo_future import text
 from mo_logs import logger
+from mo_threads import Lock
 from mo_times import Date
 
 TODAY = int(Date.now().format("%y%j"))
+prompt_locker = Lock("one question at a time")
+
+
+def ask(question):
+    """
+    ASK THE USER A QUESTION; MODULES DEPLOY CONCURRENTLY, SO ONLY ONE MAY ASK AT A TIME
+    """
+    with prompt_locker:
+        return input(question)
 
 
 class Requirement(object):
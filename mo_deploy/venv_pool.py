@@ -0,0 +1,245 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import hashlib
+import os
+import shutil
+import stat
+from time import time as unix_now
+
+from mo_dots import to_data
+from mo_files import File
+from mo_future import is_windows
+from mo_json import json2value, value2json
+from mo_logs import logger
+from mo_threads import Lock
+from mo_times import Timer
+
+DEBUG = False
+MAX_BYTES = 10 * 1024 ** 3  # DISK USE, BEFORE LEAST-RECENTLY-USED ENVIRONMENTS ARE DELETED
+META = "meta.json"  # EXISTS ONLY WHEN THE ENVIRONMENT IS COMPLETE
+VENV = ".venv"
+BARE = "bare"
+PREPARED = "prepared"
+REQUIREMENTS = ["requirements.lock", "requirements.txt"]  # IN tests/, INSTALLED IN THIS ORDER
+
+
+def venv_python(venv):
+    """
+    :return: PYTHON EXECUTABLE OF THE VIRTUAL ENVIRONMENT
+    """
+    if is_windows:
+        return File(venv) / "Scripts" / "python.exe"
+    return File(venv) / "bin" / "python"
+
+
+class VenvPool(object):
+    """
+    PREPARED VIRTUAL ENVIRONMENTS, IN TWO TIERS
+
+    * bare() - ONLY pip AND setuptools, KEYED BY PYTHON VERSION AND EXECUTABLE, SO THE MODULE CAN BE
+      CHECKED TO INSTALL AND RUN WITH NOTHING BUT ITS OWN REQUIREMENTS
+    * prepared() - THE BARE TIER WITH tests/requirements.lock AND tests/requirements.txt INSTALLED,
+      ALSO KEYED BY A HASH OF THOSE FILES
+
+    EACH CALL GETS ITS OWN CLONE.  THE CLONE IS HARDLINKED: pip UNLINKS A FILE BEFORE WRITING IT, AND
+    UNINSTALLS BY RENAME, SO IT CHANGES THE CLONE, NOT THE POOL.  THE POOLED FILES ARE ALSO READ-ONLY, SO
+    ANYTHING ELSE WRITING INTO A SHARED FILE FAILS (UNLESS RUN AS root).  ON WINDOWS, WHERE A READ-ONLY
+    FILE CAN NOT BE REPLACED, THE CLONE IS A COPY.
+    THE CLONE MUST BE USED WITH `python -m pip`, THE Scripts/*.exe STILL POINT TO THE POOLED ONE
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = File(directory)
+        self.max_bytes = max_bytes
+        self.locker = Lock("venv pool")
+        self.key_locks = {}
+        self.in_use = {}  # MAP FROM KEY TO NUMBER OF CLONES BEING MADE
+        self.envs = {}  # MAP FROM KEY TO meta OF EACH COMPLETE ENVIRONMENT
+        for d in self.directory.children if self.directory.exists else []:
+            meta_file = d / META
+            if not meta_file.exists:
+                continue
+            try:
+                self.envs[os.path.basename(d.os_path)] = json2value(meta_file.read())
+            except Exception:
+                continue
+
+    def bare_key(self, module, python_version):
+        digest = hashlib.sha1()
+        digest.update(python_version.encode("utf8"))
+        digest.update(str(module.python[python_version]).encode("utf8"))
+        return f"{BARE}-{python_version}-{digest.hexdigest()[:16]}"
+
+    def prepared_key(self, module, python_version):
+        digest = hashlib.sha1()
+        digest.update(self.bare_key(module, python_version).encode("utf8"))
+        for name in REQUIREMENTS:
+            file = module.directory / "tests" / name
+            digest.update(name.encode("utf8"))
+            if file.exists:
+                digest.update(file.read_bytes())
+        return f"{PREPARED}-{python_version}-{digest.hexdigest()[:16]}"
+
+    def bare(self, module, python_version, destination):
+        """
+        :param module: Module THAT RUNS THE COMMANDS
+        :param python_version: KEY INTO module.python
+        :param destination: File DIRECTORY TO PUT THE NEW .venv
+        :return: DIRECTORY OF THE NEW VIRTUAL ENVIRONMENT
+        """
+        key = self.bare_key(module, python_version)
+        return self._clone(key, lambda base: self._create_bare(module, python_version, base), module, destination)
+
+    def prepared(self, module, python_version, destination):
+        """
+        LIKE bare(), WITH THE TEST REQUIREMENTS OF module ALREADY INSTALLED
+        """
+        key = self.prepared_key(module, python_version)
+        return self._clone(
+            key, lambda base: self._create_prepared(module, python_version, base), module, destination,
+        )
+
+    def _clone(self, key, create, module, destination):
+        with self.locker:
+            key_lock = self.key_locks.get(key)
+            if not key_lock:
+                key_lock = self.key_locks[key] = Lock(f"venv {key}")
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+        try:
+            base = self.directory / key
+            with key_lock:
+                with self.locker:
+                    meta = self.envs.get(key)
+                if meta is None:
+                    meta = create(base)
+                meta.last_used = unix_now()
+                (base / META).write(value2json(meta))
+                with self.locker:
+                    self.envs[key] = meta
+
+            target = destination / VENV
+            with Timer("clone {key} for {module}", param={"key": key, "module": module.name}, verbose=DEBUG):
+                _clone_tree(base / VENV, target)
+            return target
+        finally:
+            with self.locker:
+                self.in_use[key] -= 1
+            self._evict()
+
+    def _create_bare(self, module, python_version, base):
+        base.delete()
+        base.create()
+        venv = base / VENV
+        python = venv_python(venv)
+        try:
+            with Timer("create pooled virtualenv {dir}", param={"dir": base.abs_path}):
+                module.local([module.python[python_version], "-m", "pip", "install", "virtualenv"])
+                module.local([module.python[python_version], "-m", "virtualenv", venv], cwd=base)
+                module.local([python, "-m", "pip", "install", "--upgrade", "pip", "setuptools"])
+            _read_only(venv)
+        except Exception as cause:
+            # NO meta.json, SO THE NEXT CLONE MAKES IT AGAIN
+            base.delete()
+            logger.error("Can not create pooled virtualenv {dir}", dir=base.abs_path, cause=cause)
+        return self._meta(python_version, base)
+
+    def _create_prepared(self, module, python_version, base):
+        base.delete()
+        base.create()
+        venv = base / VENV
+        python = venv_python(venv)
+        try:
+            self.bare(module, python_version, base)
+            with Timer("create pooled test virtualenv {dir}", param={"dir": base.abs_path}):
+                for name, args in [
+                    ("requirements.lock", ["--no-deps", "-r", "tests/requirements.lock"]),
+                    ("requirements.txt", ["-r", "tests/requirements.txt"]),
+                ]:
+                    if not (module.directory / "tests" / name).exists:
+                        continue
+                    p, stdout, stderr = module.local(
+                        [python, "-m", "pip", "install", *args], raise_on_error=False, debug=DEBUG
+                    )
+                    if p.returncode:
+                        logger.error("Can not install tests/{name}\n{stderr}", name=name, stderr=stderr)
+            _read_only(venv)
+        except Exception as cause:
+            base.delete()
+            logger.error("Can not create pooled test virtualenv {dir}", dir=base.abs_path, cause=cause)
+        return self._meta(python_version, base)
+
+    def _meta(self, python_version, base):
+        meta = to_data({"python_version": python_version, "size": _size((base / VENV).os_path)})
+        logger.info("pooled virtualenv {dir} uses {size|comma} bytes", dir=base.abs_path, size=meta.size)
+        return meta
+
+    def _evict(self):
+        """
+        DELETE LEAST RECENTLY USED ENVIRONMENTS UNTIL UNDER max_bytes
+        """
+        with self.locker:
+            total = sum(meta.size for meta in self.envs.values())
+            if total <= self.max_bytes:
+                return
+            # ALWAYS KEEP THE MOST RECENTLY USED
+            for key, meta in sorted(self.envs.items(), key=lambda e: e[1].last_used)[:-1]:
+                if total <= self.max_bytes:
+                    break
+                if self.in_use.get(key):
+                    continue
+                d = self.directory / key
+                logger.info("evict pooled virtualenv {dir}", dir=d.abs_path)
+                del self.envs[key]
+                (d / META).delete()
+                d.delete()
+                total -= meta.size
+
+
+def _clone_tree(source, destination):
+    copy = shutil.copy2 if is_windows else _link
+    shutil.copytree(File(source).os_path, File(destination).os_path, symlinks=True, copy_function=copy)
+
+
+def _link(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        # ANOTHER FILE SYSTEM
+        shutil.copy2(source, destination)
+    return destination
+
+
+def _read_only(venv):
+    """
+    SO A CLONE CAN NOT WRITE INTO THE FILES IT SHARES WITH THE POOL (ON WINDOWS THE CLONE IS A COPY)
+    """
+    if is_windows:
+        return
+    for root, dirs, files in os.walk(File(venv).os_path):
+        for f in files:
+            path = os.path.join(root, f)
+            mode = os.lstat(path).st_mode
+            if stat.S_ISREG(mode):
+                os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _size(path):
+    total = 0
+    seen = set()
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                info = os.lstat(os.path.join(root, f))
+            except Exception:
+                continue
+            if (info.st_dev, info.st_ino) in seen:
+                continue
+            seen.add((info.st_dev, info.st_ino))
+            total += info.st_size
+    return total
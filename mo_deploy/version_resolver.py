@@ -0,0 +1,141 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import mo_math
+from mo_logs import logger
+from mo_times import Timer
+from pyLibrary.utils import Version
+
+DEBUG = False
+
+
+class VersionResolver(object):
+    """
+    FIND THE MODULES THAT NEED AN INCIDENTAL VERSION BUMP
+
+    A NODE IS A (module name, version) PAIR; ITS EDGES ARE THE REQUIREMENTS RECORDED IN THAT VERSION
+    (module.get_old_dependencies(version)). EACH NODE IS EXPANDED ONCE. WHEN A MODULE STARTS
+    UPGRADING, ONLY THE NODES THAT CAN REACH IT ARE LOOKED AT AGAIN.
+
+    A MODULE MUST UPGRADE WHEN
+    * ONE OF ITS OLD REQUIREMENTS DISAGREES WITH THE VERSION IN USE (A CONFLICT)
+    * SOMETHING IT (TRANSITIVELY) REQUIRES IS UPGRADING
+    """
+
+    def __init__(self, modules, curr_versions, next_minor_version, today, get_pypi_version):
+        """
+        :param modules: MAP FROM NAME TO MANAGED Module
+        :param curr_versions: MAP FROM NAME TO VERSION IN USE, FILLED WITH THIRD-PARTY VERSIONS AS THEY ARE FOUND
+        :param next_minor_version: MINOR VERSION OF ALL NEW RELEASES
+        :param today: PATCH VERSION OF ALL NEW RELEASES
+        :param get_pypi_version: FUNCTION TO GET THE LATEST VERSION OF AN UNMANAGED PACKAGE
+        """
+        self.modules = modules
+        self.curr_versions = curr_versions
+        self.next_minor_version = next_minor_version
+        self.today = today
+        self.get_pypi_version = get_pypi_version
+
+    def resolve(self, roots, next_version, is_upgrading):
+        """
+        :param roots: Modules TO DEPLOY, EACH HAS AN ENTRY IN next_version
+        :param next_version: MAP FROM NAME TO NEW VERSION, MORE ARE ADDED
+        :param is_upgrading: SET OF MODULE NAMES THAT UPGRADE, MORE ARE ADDED
+        """
+        children = {}  # MAP FROM NODE TO LIST OF (req name, child node) FOR MANAGED REQUIREMENTS
+        parents = {}  # MAP FROM NODE TO SET OF NODES THAT REQUIRE IT
+        nodes_of = {}  # MAP FROM MODULE NAME TO ITS NODES
+        new_version_of = {}  # MAP FROM NODE TO THE VERSION IT GETS IF IT MUST UPGRADE (None FOR ROOTS)
+        reaches_upgrade = set()  # NODES THAT ARE UPGRADING, OR REQUIRE (TRANSITIVELY) SOMETHING UPGRADING
+        root_names = set(r.name for r in roots)
+        todo = []  # WORKLIST (STACK, SO REQUIREMENTS ARE SEEN IN THE SAME ORDER AS A DEPTH-FIRST SCAN)
+
+        def add_node(node, new_version):
+            if node in children:
+                return
+            children[node] = None
+            new_version_of[node] = new_version
+            nodes_of.setdefault(node[0], []).append(node)
+            todo.append(node)
+
+        def start_upgrade(name, version):
+            if name in is_upgrading:
+                return
+            is_upgrading.add(name)
+            if version is not None:
+                next_version[name] = version
+            # EVERY NODE OF THIS MODULE NOW REACHES AN UPGRADE
+            todo.extend(nodes_of.get(name, []))
+
+        def set_next_version(name, version):
+            next_version[name] = version
+            if name in root_names:
+                # THE ROOT IS DEPLOYED AT A NEW VERSION, SO LOOK AT THAT VERSION'S REQUIREMENTS
+                add_node((name, version), None)
+
+        for r in reversed(roots):
+            add_node((r.name, next_version[r.name]), None)
+
+        expanded = 0
+        with Timer("resolve versions", verbose=DEBUG):
+            while todo:
+                node = todo.pop()
+                name, version = node
+                module = self.modules[name]
+                if children[node] is None:
+                    # FIRST VISIT: EXPAND, AND CHECK THE OLD REQUIREMENTS FOR CONFLICTS
+                    expanded += 1
+                    edges = children[node] = []
+                    for req in module.get_old_dependencies(version):
+                        req_name, req_version = req["name"], req["version"]
+                        managed_req = self.modules.get(req_name)
+                        if not req_version:
+                            curr_version = self.curr_versions.setdefault(req_name, self.get_pypi_version(req_name))
+                            req_version = curr_version
+                        else:
+                            curr_version = self.curr_versions.setdefault(req_name, req_version)
+
+                        req_new_version = Version((
+                            mo_math.max(curr_version.major, managed_req.get_version()[0].major if managed_req else None),
+                            self.next_minor_version,
+                            self.today,
+                        ))
+
+                        if name not in is_upgrading:
+                            if curr_version < req_version:
+                                set_next_version(req_name, req_new_version)
+                                start_upgrade(name, None)
+                            elif req_version < curr_version:
+                                # THERE IS A CONFLICT SOMEWHERE IN THE DEPENDENCY TREE
+                                start_upgrade(
+                                    name, Version((module.version.major, self.next_minor_version, self.today)),
+                                )
+
+                        if managed_req:
+                            child = (req_name, curr_version)
+                            edges.append(child)
+                            parents.setdefault(child, set()).add(node)
+                            add_node(child, req_new_version)
+
+                # A MODULE BETWEEN TWO UPGRADES MUST ALSO UPGRADE
+                if name not in is_upgrading and any(c in reaches_upgrade for c in children[node]):
+                    new_version = new_version_of[node]
+                    if new_version is None:
+                        logger.error("do not know how to handle")
+                    start_upgrade(name, new_version)
+
+                if node not in reaches_upgrade and (
+                    name in is_upgrading or any(c in reaches_upgrade for c in children[node])
+                ):
+                    reaches_upgrade.add(node)
+                    todo.extend(parents.get(node, ()))
+
+        DEBUG and logger.info(
+            "expanded {{num}} nodes, {{upgrading}} modules upgrading", num=expanded, upgrading=len(is_upgrading),
+        )
+        return next_version
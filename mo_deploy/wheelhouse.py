@@ -0,0 +1,120 @@
+# encoding: utf-8
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Author: Kyle Lahnakoski (kyle@lahnakoski.com)
+#
+import os
+import tempfile
+
+from mo_deploy.trace import tracer
+from mo_files import File
+from mo_logs import logger
+from mo_threads import Lock, Signal
+from mo_times import Timer
+
+DEBUG = False
+
+
+class Wheelhouse(object):
+    """
+    ONE DIRECTORY OF WHEELS FOR THE WHOLE RUN
+
+    * EVERY MODULE DEPOSITS ITS FRESHLY BUILT WHEEL, SO DEPENDENTS CAN INSTALL IT BEFORE IT IS ON THE INDEX
+    * THIRD-PARTY WHEELS ARE DOWNLOADED ONCE, NOT ONCE PER virtualenv
+    * WHEELS ARE WRITTEN TO A STAGING DIRECTORY, THEN MOVED IN, SO A pip READING THE WHEELHOUSE
+      NEVER SEES HALF A FILE, AND FILLS FOR DIFFERENT REQUIREMENTS RUN AT ONCE
+    """
+
+    def __init__(self, directory):
+        self.directory = File(directory)
+        self.directory.delete()
+        self.directory.create()
+        self.staging = File(self.directory.abs_path + "-staging")
+        self.staging.delete()
+        self.staging.create()
+        self.locker = Lock("wheelhouse")
+        self.fill_locks = {}  # MAP FROM REQUIREMENTS TO Lock, SO THE SAME FILL IS NOT DONE TWICE AT ONCE
+        self.signals = {}  # MAP FROM PACKAGE NAME TO Signal FOR WHEN ITS WHEEL IS DEPOSITED
+
+    def available(self, package_name):
+        """
+        :return: Signal THAT FIRES WHEN THE WHEEL FOR package_name IS DEPOSITED
+        """
+        with self.locker:
+            signal = self.signals.get(package_name)
+            if not signal:
+                signal = self.signals[package_name] = Signal(f"{package_name} wheel is available")
+            return signal
+
+    def deposit(self, package_name, dist_directory):
+        """
+        COPY THE WHEELS FOUND IN dist_directory INTO THE WHEELHOUSE
+        """
+        wheels = [f for f in File(dist_directory).children if f.extension == "whl"]
+        if not wheels:
+            logger.error("Expecting a wheel in {dir}", dir=File(dist_directory).abs_path)
+        staging = File(tempfile.mkdtemp(dir=self.staging.os_path))
+        try:
+            for w in wheels:
+                File.copy(w, staging / w.abs_path.split("/")[-1])
+                DEBUG and logger.info("deposit {wheel}", wheel=w.abs_path)
+            self._move_in(staging)
+        finally:
+            staging.delete()
+        self.available(package_name).go()
+
+    @property
+    def find_links(self):
+        return ["--find-links", self.directory.os_path]
+
+    def pip_install(self, module, python, args, upgrade=False, debug=False, watch=None, fill=None):
+        """
+        INSTALL args (REQUIREMENTS, LIKE ["-r", "requirements.txt"]) USING THE WHEELHOUSE
+
+        FIRST `pip wheel` FILLS THE WHEELHOUSE WITH WHAT IS MISSING (FROM THE INDEX), THEN THE
+        INSTALL IS DONE WITH --no-index.  IF THAT FAILS, INSTALL AGAIN WITH THE INDEX AS BACKUP.
+
+        :param fill: WHAT `pip wheel` ADDS TO THE WHEELHOUSE (DEFAULT IS args); ONLY TESTED WHEELS
+                     MAY BE IN THE WHEELHOUSE, SO AN UNTESTED WHEEL IS INSTALLED, BUT NOT FILLED
+        """
+        fill = args if fill is None else fill
+        if fill:
+            with tracer.acquire("wait for wheelhouse", self._fill_lock(module, fill)):
+                with Timer("fill wheelhouse for {module}", param={"module": module.name}, verbose=DEBUG):
+                    staging = File(tempfile.mkdtemp(dir=self.staging.os_path))
+                    try:
+                        module.local(
+                            [python, "-m", "pip", "wheel", "--wheel-dir", staging.os_path, *self.find_links, *fill],
+                            raise_on_error=False,
+                        )
+                        self._move_in(staging)
+                    finally:
+                        staging.delete()
+        install = [python, "-m", "pip", "install", *(["--upgrade"] if upgrade else []), *self.find_links]
+        p, stdout, stderr = module.local(
+            [*install, "--no-index", *args], raise_on_error=False, debug=debug, watch=watch
+        )
+        if p.returncode:
+            logger.info("wheelhouse is missing something, use index for {args}", args=args)
+            p, stdout, stderr = module.local([*install, *args], raise_on_error=False, debug=debug, watch=watch)
+        return p, stdout, stderr
+
+    def _fill_lock(self, module, fill):
+        # fill MAY NAME FILES (LIKE tests/requirements.txt) IN THE MODULE DIRECTORY
+        key = (module.directory.abs_path, *(str(f) for f in fill))
+        with self.locker:
+            lock = self.fill_locks.get(key)
+            if not lock:
+                lock = self.fill_locks[key] = Lock(f"fill wheelhouse for {module.name}")
+            return lock
+
+    def _move_in(self, staging):
+        """
+        MOVE THE WHEELS IN staging INTO THE WHEELHOUSE (A RENAME, SO EACH APPEARS ALL AT ONCE)
+        """
+        for f in staging.children:
+            if f.extension == "whl":
+                os.replace(f.os_path, (self.directory / f.abs_path.split("/")[-1]).os_path)